@@ -1,18 +1,117 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, make_response, abort, stream_with_context, g, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from sqlalchemy import and_, or_, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.http import is_resource_modified
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import click
+import csv
+import hashlib
+import io
+import itertools
+import json
+import logging
 import os
+import sqlite3
+import threading
+import time
+
+# Database engine configuration
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///projects.db')
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        return {'connect_args': {'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000}}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    }
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    # Negative values are KiB rather than pages
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///projects.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 50))
+app.config['PROGRESS_WEIGHTING'] = os.environ.get('PROGRESS_WEIGHTING', 'count')
+app.config['BULK_MAX_ITEMS'] = int(os.environ.get('BULK_MAX_ITEMS', 5000))
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 1))
+app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['LOGIN_HASH_WORKERS'] = int(os.environ.get('LOGIN_HASH_WORKERS', 2))
+app.config['LOGIN_QUEUE_SIZE'] = int(os.environ.get('LOGIN_QUEUE_SIZE', 2))
+app.config['LOGIN_QUEUE_TIMEOUT'] = float(os.environ.get('LOGIN_QUEUE_TIMEOUT', 0.25))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['ACTIVITY_PAGE_SIZE'] = int(os.environ.get('ACTIVITY_PAGE_SIZE', 20))
+app.config['STATIC_MAX_AGE'] = int(os.environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))
+app.config['WORKLOAD_WEEKS'] = int(os.environ.get('WORKLOAD_WEEKS', 4))
+app.config['WORKLOAD_WEEKLY_CAPACITY'] = int(os.environ.get('WORKLOAD_WEEKLY_CAPACITY', 5))
+app.config['CHANGE_FEED_POLL_SECONDS'] = float(os.environ.get('CHANGE_FEED_POLL_SECONDS', 1))
+app.config['CHANGE_FEED_MAX_SECONDS'] = float(os.environ.get('CHANGE_FEED_MAX_SECONDS', 300))
+app.config['CHANGE_FEED_BATCH_SIZE'] = int(os.environ.get('CHANGE_FEED_BATCH_SIZE', 200))
+app.config['CHANGE_FEED_RETENTION_DAYS'] = int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', 7))
+app.config['CHANGE_FEED_REORDER_WINDOW'] = int(os.environ.get('CHANGE_FEED_REORDER_WINDOW', 1000))
+app.config['CHANGE_FEED_GAP_SECONDS'] = float(os.environ.get('CHANGE_FEED_GAP_SECONDS', 30))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 1000))
+app.config['FRAGMENT_CACHE_PATH'] = os.environ.get('FRAGMENT_CACHE_PATH')
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+
+# Compiled templates survive restarts, so new workers skip Jinja's parse and compile step
+if app.config['TEMPLATE_CACHE_DIR']:
+    try:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    except OSError:
+        pass
 
 db = SQLAlchemy(app)
 
 # Models
 class User(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_is_active', 'is_active'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
@@ -22,8 +121,14 @@ class User(db.Model):
     email = db.Column(db.String(200))
     phone = db.Column(db.String(50))
     is_active = db.Column(db.Boolean, default=True)
+    workload = db.relationship('EmployeeWorkload', uselist=False, viewonly=True)
 
 class Project(db.Model):
+    __table_args__ = (
+        db.Index('ix_project_created_at', 'created_at'),
+        db.Index('ix_project_status_created_at', 'status', 'created_at'),
+        db.Index('ix_project_created_by_created_at', 'created_by', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_code = db.Column(db.String(50), unique=True, nullable=False)
     name = db.Column(db.String(200), nullable=False)
@@ -37,8 +142,18 @@ class Project(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     approved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime)
+    creator = db.relationship('User', foreign_keys=[created_by])
+    approver = db.relationship('User', foreign_keys=[approved_by])
+    ledger = db.relationship('ProjectLedger', uselist=False)
+    task_rollup = db.relationship('ProjectProgress', uselist=False)
 
 class Task(db.Model):
+    __table_args__ = (
+        db.Index('ix_task_project_id_created_at', 'project_id', 'created_at'),
+        db.Index('ix_task_assigned_to_status', 'assigned_to', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
     name = db.Column(db.String(200), nullable=False)
@@ -49,8 +164,50 @@ class Task(db.Model):
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    assignee = db.relationship('User', foreign_keys=[assigned_to])
+
+class TaskDependency(db.Model):
+    """Edge of a project's task graph: ``task_id`` cannot start before ``depends_on_id`` is finished."""
+    __table_args__ = (
+        db.Index('ix_task_dependency_project_id', 'project_id'),
+        db.Index('ix_task_dependency_depends_on_id', 'depends_on_id'),
+    )
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    depends_on_id = db.Column(db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+
+class TaskSchedule(db.Model):
+    """Stored critical-path state of a task, in whole days from the project's anchor date (see CriticalPath)."""
+    __table_args__ = (
+        db.Index('ix_task_schedule_project_id', 'project_id'),
+    )
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    duration = db.Column(db.Integer, nullable=False, default=0)
+    floor = db.Column(db.Integer, nullable=False, default=0)
+    earliest_start = db.Column(db.Integer, nullable=False, default=0)
+    tail = db.Column(db.Integer, nullable=False, default=0)
+
+class EmployeeWorkload(db.Model):
+    """Assigned task counts per employee and status, so capacity views never scan the task table."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    not_started = db.Column(db.Integer, nullable=False, default=0)
+    in_progress = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Integer, nullable=False, default=0)
+
+class EmployeeWeeklyEffort(db.Model):
+    """Days of unfinished task work an employee has in each week, from the tasks' date ranges."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)
+    effort_days = db.Column(db.Integer, nullable=False, default=0)
 
 class PurchaseRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_purchase_request_created_at', 'created_at'),
+        db.Index('ix_purchase_request_project_id_created_at', 'project_id', 'created_at'),
+        db.Index('ix_purchase_request_requested_by_created_at', 'requested_by', 'created_at'),
+        db.Index('ix_purchase_request_supplier_id', 'supplier_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
     requested_by = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -59,8 +216,12 @@ class PurchaseRequest(db.Model):
     estimated_cost = db.Column(db.Float)
     status = db.Column(db.String(50), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    supplier = db.relationship('Supplier')
 
 class Supplier(db.Model):
+    __table_args__ = (
+        db.Index('ix_supplier_is_active', 'is_active'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     contact_person = db.Column(db.String(200))
@@ -71,6 +232,10 @@ class Supplier(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Invoice(db.Model):
+    __table_args__ = (
+        db.Index('ix_invoice_created_at', 'created_at'),
+        db.Index('ix_invoice_project_id_created_at', 'project_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
     invoice_type = db.Column(db.String(50))
@@ -80,31 +245,1102 @@ class Invoice(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Comment(db.Model):
+    __table_args__ = (
+        db.Index('ix_comment_project_id_created_at', 'project_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     comment_text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User')
+
+class ProjectStatusCount(db.Model):
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ProjectLedger(db.Model):
+    """Running money totals per project, in integer minor units (1/100 riyal)."""
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    approved_purchases = db.Column(db.BigInteger, nullable=False, default=0)
+    invoiced = db.Column(db.BigInteger, nullable=False, default=0)
+    paid = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    @property
+    def outstanding(self):
+        return self.invoiced - self.paid
+
+class ProjectProgress(db.Model):
+    """Weighted sum of task progress per project, so the project percentage never needs a task scan."""
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    task_weight = db.Column(db.BigInteger, nullable=False, default=0)
+    weighted_progress = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ProjectActivity(db.Model):
+    """Append-only audit trail of a project: comments, status and progress changes, purchases and invoices."""
+    __table_args__ = (
+        db.Index('ix_project_activity_project_id_created_at_id', 'project_id', 'created_at', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    action = db.Column(db.String(30), nullable=False)
+    ref_id = db.Column(db.Integer)
+    old_value = db.Column(db.String(50))
+    new_value = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User')
+    comment = db.relationship('Comment', viewonly=True,
+                              primaryjoin="and_(ProjectActivity.action == 'comment', foreign(ProjectActivity.ref_id) == Comment.id)")
+
+class ChangeEvent(db.Model):
+    """Append-only feed of changed dashboard rows; the id doubles as the Server-Sent Events id."""
+    __table_args__ = (
+        db.Index('ix_change_event_created_at', 'created_at'),
+        # Ids must never be reused after pruning, or resuming clients would skip events
+        {'sqlite_autoincrement': True},
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VersionStamp(db.Model):
+    """Change counter for data without a version column of its own (see STAMPS); feeds page ETags."""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+# Project status counters
+def increment_row(model, key, **deltas):
+    """Add ``deltas`` to the ``model`` row matching ``key`` with one UPDATE, creating the row if missing."""
+    updated = model.query.filter_by(**key).update(
+        {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items()},
+        synchronize_session=False)
+    if not updated:
+        db.session.add(model(**key, **deltas))
+        db.session.flush()
+
+def increment_rows(model, key, column, deltas):
+    """Batch form of increment_row: ``deltas`` maps key values of column ``key`` to the amount added to ``column``.
+    
+    ``key`` may also be a tuple of column names, with ``deltas`` keyed by tuples of their values.
+    """
+    deltas = {value: delta for value, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if not isinstance(key, tuple):
+        key, deltas = (key,), {(value,): delta for value, delta in deltas.items()}
+    key_columns, target = [getattr(model, name) for name in key], getattr(model, column)
+    # Each key column filtered on its own values: a superset of the wanted rows that every index can serve
+    candidates = db.session.query(*key_columns).filter(
+        *(key_column.in_({value[i] for value in deltas}) for i, key_column in enumerate(key_columns)))
+    existing = {tuple(row) for row in candidates} & deltas.keys()
+    if existing:
+        db.session.execute(
+            db.update(model.__table__).where(*(key_column == db.bindparam(f'key_{name}') for name, key_column in zip(key, key_columns)))
+            .values({column: target + db.bindparam('delta')}),
+            [{**{f'key_{name}': part for name, part in zip(key, value)}, 'delta': deltas[value]} for value in existing])
+    db.session.add_all(model(**dict(zip(key, value)), **{column: delta}) for value, delta in deltas.items() if value not in existing)
+    db.session.flush()
+
+def change_status(item, column, status):
+    """Set ``item.<column>`` with an UPDATE guarded by the value this request read.
+    
+    Returns False, writing nothing, when another request changed it first; callers apply their
+    counter deltas only on True, so two concurrent clicks cannot both count.
+    """
+    model = type(item)
+    changed = model.query.filter_by(id=item.id, **{column: getattr(item, column)}).update(
+        {getattr(model, column): status}, synchronize_session=False)
+    if changed:
+        set_committed_value(item, column, status)
+    return bool(changed)
+
+def count_status_change(old_status, new_status):
+    """Move one project between status counters inside the caller's transaction."""
+    if old_status == new_status:
+        return
+    for status, delta in ((old_status, -1), (new_status, 1)):
+        if status is not None:
+            increment_row(ProjectStatusCount, {'status': status}, count=delta)
+
+def set_project_status(project, status):
+    """Move ``project`` to ``status`` with its counters; False when a concurrent request changed its status first."""
+    old_status = project.status
+    if not change_status(project, 'status', status):
+        return False
+    count_status_change(old_status, status)
+    log_activity(project.id, 'status', old_value=old_status, new_value=status)
+    bump_project_version(project.id)
+    record_change(project)
+    return True
+
+def get_status_counts():
+    return {row.status: row.count for row in ProjectStatusCount.query.all()}
+
+def rebuild_status_counts():
+    """Recount projects per status, rewrite the counters and return the drift found."""
+    actual = dict(db.session.query(Project.status, db.func.count(Project.id)).group_by(Project.status).all())
+    stored = get_status_counts()
+    drift = {status: (stored.get(status, 0), actual.get(status, 0))
+             for status in set(actual) | set(stored)
+             if stored.get(status, 0) != actual.get(status, 0)}
+    ProjectStatusCount.query.delete()
+    db.session.add_all(ProjectStatusCount(status=status, count=count) for status, count in actual.items())
+    db.session.commit()
+    return drift
+
+@app.cli.command('reconcile-status-counts')
+def reconcile_status_counts_command():
+    """Rebuild project status counters from the project table and report drift."""
+    drift = rebuild_status_counts()
+    if not drift:
+        print("✅ Status counters are in sync")
+    for status, (stored, actual) in sorted(drift.items()):
+        print(f"⚠️ {status}: counter={stored} actual={actual}")
+
+# Financial ledger
+MINOR_UNITS = 100
+
+@app.template_filter('minor')
+def to_minor(amount):
+    """Convert a form value or stored float amount to exact integer minor units."""
+    value = Decimal(str(amount or 0)) * MINOR_UNITS
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def ledger_purchase_status(purchase, status):
+    """Set a purchase's status, moving its cost in or out of the approved total; False if a concurrent request changed it first."""
+    was_approved, is_approved = purchase.status == 'approved', status == 'approved'
+    if not change_status(purchase, 'status', status):
+        return False
+    if was_approved != is_approved:
+        amount = to_minor(purchase.estimated_cost)
+        increment_row(ProjectLedger, {'project_id': purchase.project_id},
+                      approved_purchases=amount if is_approved else -amount)
+    return True
+
+def ledger_invoice_created(invoice):
+    increment_row(ProjectLedger, {'project_id': invoice.project_id}, invoiced=to_minor(invoice.amount))
+
+def ledger_invoice_paid(invoice):
+    """Mark an invoice paid and add it to the paid total; False if it already was, possibly by a concurrent request."""
+    if invoice.payment_status == 'paid' or not change_status(invoice, 'payment_status', 'paid'):
+        return False
+    increment_row(ProjectLedger, {'project_id': invoice.project_id}, paid=to_minor(invoice.amount))
+    return True
+
+def rebuild_ledger():
+    """Recompute every project's ledger from the purchase and invoice tables; returns projects that drifted."""
+    totals = {}
+    def row(project_id):
+        return totals.setdefault(project_id, {'approved_purchases': 0, 'invoiced': 0, 'paid': 0})
+    for project_id, cost in db.session.query(PurchaseRequest.project_id, PurchaseRequest.estimated_cost).filter_by(status='approved').yield_per(5000):
+        row(project_id)['approved_purchases'] += to_minor(cost)
+    for project_id, amount, payment_status in db.session.query(Invoice.project_id, Invoice.amount, Invoice.payment_status).yield_per(5000):
+        row(project_id)['invoiced'] += to_minor(amount)
+        if payment_status == 'paid':
+            row(project_id)['paid'] += to_minor(amount)
+    drifted = []
+    for ledger in ProjectLedger.query.all():
+        expected = totals.get(ledger.project_id, {'approved_purchases': 0, 'invoiced': 0, 'paid': 0})
+        if any(getattr(ledger, name) != value for name, value in expected.items()):
+            drifted.append(ledger.project_id)
+    ProjectLedger.query.delete()
+    db.session.add_all(ProjectLedger(project_id=project_id, **values)
+                       for project_id, values in totals.items() if project_id is not None)
+    db.session.commit()
+    return drifted
+
+@app.cli.command('rebuild-ledger')
+def rebuild_ledger_command():
+    """Rebuild per-project financial totals from purchases and invoices."""
+    drifted = rebuild_ledger()
+    print(f"✅ Ledger rebuilt ({len(drifted)} project(s) had drifted)")
+
+@app.template_filter('money')
+def money_filter(minor):
+    return f"{Decimal(minor or 0) / MINOR_UNITS:,.2f}"
+
+# Task progress rollup
+def task_weight(task):
+    """1 per task, or the task's length in days when PROGRESS_WEIGHTING is 'duration'."""
+    if app.config['PROGRESS_WEIGHTING'] == 'duration' and task.start_date and task.end_date and task.end_date >= task.start_date:
+        return (task.end_date - task.start_date).days + 1
+    return 1
+
+def rollup_percent():
+    """SQL expression for a project's rounded task-weighted progress."""
+    return (db.select((ProjectProgress.weighted_progress + ProjectProgress.task_weight // 2) // ProjectProgress.task_weight)
+            .where(ProjectProgress.project_id == Project.id, ProjectProgress.task_weight > 0)
+            .scalar_subquery())
+
+def rollup_task_change(task, old_progress, added=False):
+    """Fold one task's progress change into its project's percentage inside the caller's transaction."""
+    weight = task_weight(task)
+    increment_row(ProjectProgress, {'project_id': task.project_id},
+                  task_weight=weight if added else 0,
+                  weighted_progress=weight * ((task.progress_percent or 0) - old_progress))
+    Project.query.filter_by(id=task.project_id).update(
+        {Project.progress_percent: rollup_percent()}, synchronize_session=False)
+
+def recompute_progress():
+    """Rebuild every project's rollup from its tasks and return how many projects were updated."""
+    before = dict(db.session.query(Project.id, Project.progress_percent))
+    totals = {}
+    tasks = db.session.query(Task.project_id, Task.start_date, Task.end_date, Task.progress_percent)
+    for task in tasks.yield_per(5000):
+        weight = task_weight(task)
+        row = totals.setdefault(task.project_id, [0, 0])
+        row[0] += weight
+        row[1] += weight * (task.progress_percent or 0)
+    ProjectProgress.query.delete()
+    db.session.add_all(ProjectProgress(project_id=project_id, task_weight=weight, weighted_progress=progress)
+                       for project_id, (weight, progress) in totals.items() if project_id is not None)
+    db.session.flush()
+    updated = Project.query.filter(Project.id.in_(db.select(ProjectProgress.project_id))).update(
+        {Project.progress_percent: rollup_percent(), Project.version: Project.version + 1,
+         Project.updated_at: datetime.utcnow()}, synchronize_session=False)
+    # Corrected progress bars reach open dashboards, and their ETags, through the change feed
+    record_changes('project', [project_id for project_id, percent in db.session.query(Project.id, Project.progress_percent)
+                               if before.get(project_id) != percent])
+    db.session.commit()
+    return updated
+
+@app.cli.command('recompute-progress')
+def recompute_progress_command():
+    """Backfill project progress from tasks (also needed after changing PROGRESS_WEIGHTING)."""
+    updated = recompute_progress()
+    print(f"✅ Progress recomputed for {updated} project(s)")
+
+# Task scheduling (critical path)
+class CriticalPath:
+    """Critical-path schedule of one project's task graph, in whole days from the project's anchor date.
+    
+    Each task keeps its earliest start (its longest chain of predecessors, never before its own start
+    date) and its tail (the longest chain from its start to the end of the project). The project length,
+    latest starts and slack all follow from those two numbers, so a change only revisits the descendants'
+    earliest starts and the ancestors' tails, and stops wherever a value comes out unchanged.
+    """
+    
+    def __init__(self):
+        self.duration, self.floor, self.earliest, self.tail = {}, {}, {}, {}
+        self.preds, self.succs = defaultdict(set), defaultdict(set)
+    
+    def set_task(self, task_id, duration, floor):
+        self.duration[task_id] = duration
+        self.floor[task_id] = floor
+    
+    def add_edge(self, task_id, depends_on_id):
+        self.preds[task_id].add(depends_on_id)
+        self.succs[depends_on_id].add(task_id)
+    
+    def remove_edge(self, task_id, depends_on_id):
+        self.preds[task_id].discard(depends_on_id)
+        self.succs[depends_on_id].discard(task_id)
+    
+    def has_path(self, source, target):
+        """Whether ``target`` is ``source`` or one of its descendants."""
+        seen, stack = {source}, [source]
+        while stack:
+            node = stack.pop()
+            if node == target:
+                return True
+            for succ in self.succs.get(node, ()):
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return False
+    
+    def finish(self):
+        """Project length in days: the latest earliest finish of any task."""
+        return max((self.earliest[task_id] + duration for task_id, duration in self.duration.items()), default=0)
+    
+    def slack(self, task_id, finish):
+        """Days a task can slip without moving the project's finish; 0 on the critical path."""
+        return finish - self.tail[task_id] - self.earliest[task_id]
+    
+    def update(self, forward=(), backward=()):
+        """Recompute after a change and return the tasks whose earliest start or tail moved.
+    
+        ``forward`` are tasks whose duration, floor or predecessors changed, ``backward`` tasks whose
+        duration or successors changed. Raises ValueError if the affected part of the graph has a cycle.
+        """
+        changed = self._propagate(set(forward), self.succs, self.preds, self.earliest, self._earliest_start)
+        return changed | self._propagate(set(backward), self.preds, self.succs, self.tail, self._tail)
+    
+    def _earliest_start(self, task_id):
+        return max([self.floor[task_id]] + [self.earliest[pred] + self.duration[pred] for pred in self.preds.get(task_id, ())])
+    
+    def _tail(self, task_id):
+        return self.duration[task_id] + max((self.tail[succ] for succ in self.succs.get(task_id, ())), default=0)
+    
+    def _propagate(self, starts, outgoing, incoming, values, compute):
+        # Everything downstream of the starts, visited in topological order so each value is computed once
+        reach, stack = set(starts), list(starts)
+        while stack:
+            for node in outgoing.get(stack.pop(), ()):
+                if node not in reach:
+                    reach.add(node)
+                    stack.append(node)
+        waiting = {node: sum(1 for other in incoming.get(node, ()) if other in reach) for node in reach}
+        ready = [node for node, count in waiting.items() if not count]
+        dirty, changed, visited = set(starts), set(), 0
+        while ready:
+            node = ready.pop()
+            visited += 1
+            if node in dirty:
+                value = compute(node)
+                if value != values.get(node):
+                    values[node] = value
+                    changed.add(node)
+                    dirty.update(outgoing.get(node, ()))
+                elif node in starts:
+                    # An unchanged start with a new duration still moves its neighbours
+                    dirty.update(outgoing.get(node, ()))
+            for other in outgoing.get(node, ()):
+                waiting[other] -= 1
+                if not waiting[other]:
+                    ready.append(other)
+        if visited != len(reach):
+            raise ValueError('task dependencies contain a cycle')
+        return changed
+
+SCHEDULE_COLUMNS = ('duration', 'floor', 'earliest_start', 'tail')
+
+def schedule_anchor(project):
+    """Day zero of a project's schedule."""
+    return project.start_date or (project.created_at or datetime.utcnow()).date()
+
+def task_duration(task):
+    """Days of work left in a task: none once done, otherwise its date span (one day when undated)."""
+    if task.status == 'done':
+        return 0
+    if task.start_date and task.end_date and task.end_date >= task.start_date:
+        return (task.end_date - task.start_date).days + 1
+    return 1
+
+def task_floor(task, anchor):
+    """Days after the anchor before which a task cannot start."""
+    return max(0, (task.start_date - anchor).days) if task.start_date else 0
+
+def reachable_tasks(task_ids, source, target):
+    """Recursive CTE of ``task_ids`` plus every task reached by walking dependency edges from ``source`` to ``target``."""
+    reached = db.select(Task.id).where(Task.id.in_(task_ids)).cte(recursive=True)
+    return reached.union(db.select(target).join(reached, source == reached.c.id))
+
+def load_critical_path(project_id, forward=None, backward=None):
+    """A project's stored schedule and dependency edges, read as plain rows with one query each.
+    
+    Given ``forward``/``backward`` task ids, only what CriticalPath.update can touch from them is read: the
+    descendants of ``forward`` and the ancestors of ``backward``, with their edges and neighbouring tasks.
+    """
+    edges = db.select(TaskDependency.task_id, TaskDependency.depends_on_id)
+    if forward is None and backward is None:
+        edges = edges.where(TaskDependency.project_id == project_id)
+        tasks = TaskSchedule.project_id == project_id
+    else:
+        descendants = reachable_tasks(forward or [], TaskDependency.depends_on_id, TaskDependency.task_id)
+        ancestors = reachable_tasks(backward or [], TaskDependency.task_id, TaskDependency.depends_on_id)
+        edges = edges.where(or_(TaskDependency.task_id.in_(db.select(descendants.c.id)),
+                                TaskDependency.depends_on_id.in_(db.select(ancestors.c.id))))
+        around = edges.subquery()
+        tasks = TaskSchedule.task_id.in_(db.union(
+            db.select(descendants.c.id), db.select(ancestors.c.id),
+            db.select(around.c.task_id), db.select(around.c.depends_on_id)))
+    graph = CriticalPath()
+    rows = db.session.execute(db.select(TaskSchedule.task_id, *(getattr(TaskSchedule, c) for c in SCHEDULE_COLUMNS)).where(tasks))
+    for task_id, duration, floor, earliest_start, tail in rows:
+        graph.set_task(task_id, duration, floor)
+        graph.earliest[task_id] = earliest_start
+        graph.tail[task_id] = tail
+    for task_id, depends_on_id in db.session.execute(edges):
+        graph.add_edge(task_id, depends_on_id)
+    return graph
+
+def save_schedule(project_id, graph, task_ids, new_ids=()):
+    """Write the schedule rows of ``task_ids`` from ``graph``, inserting those in ``new_ids``."""
+    rows = [{'task_id': task_id, 'project_id': project_id, 'duration': graph.duration[task_id], 'floor': graph.floor[task_id],
+             'earliest_start': graph.earliest[task_id], 'tail': graph.tail[task_id]} for task_id in task_ids]
+    inserts = [row for row in rows if row['task_id'] in new_ids]
+    updates = [{'key_value': row['task_id'], **{f'new_{c}': row[c] for c in SCHEDULE_COLUMNS}}
+               for row in rows if row['task_id'] not in new_ids]
+    if inserts:
+        db.session.execute(db.insert(TaskSchedule), inserts)
+    if updates:
+        db.session.execute(
+            db.update(TaskSchedule.__table__).where(TaskSchedule.task_id == db.bindparam('key_value'))
+            .values({c: db.bindparam(f'new_{c}') for c in SCHEDULE_COLUMNS}),
+            updates)
+
+def schedule_new_tasks(tasks):
+    """Schedule tasks that have no dependencies yet without loading their projects' graphs."""
+    anchors, rows = {}, []
+    for task in tasks:
+        if task.project_id not in anchors:
+            anchors[task.project_id] = schedule_anchor(db.session.get(Project, task.project_id))
+        duration, floor = task_duration(task), task_floor(task, anchors[task.project_id])
+        rows.append({'task_id': task.id, 'project_id': task.project_id, 'duration': duration, 'floor': floor,
+                     'earliest_start': floor, 'tail': duration})
+    if rows:
+        db.session.execute(db.insert(TaskSchedule), rows)
+
+def reschedule(project_id, task_ids=(), forward=(), backward=(), graph=None):
+    """Fold changed tasks and edges into a project's stored schedule inside the caller's transaction.
+
+    ``task_ids`` are tasks whose status or dates changed; ``forward`` and ``backward`` are extra starting
+    points after an edge change (see CriticalPath.update). Only rows whose values moved are written.
+    """
+    graph = graph or load_critical_path(project_id, set(forward) | set(task_ids), set(backward) | set(task_ids))
+    anchor = schedule_anchor(db.session.get(Project, project_id))
+    touched, new_ids = set(), set()
+    for task in map(partial(db.session.get, Task), task_ids):
+        duration, floor = task_duration(task), task_floor(task, anchor)
+        if task.id not in graph.duration:
+            new_ids.add(task.id)
+        elif (graph.duration[task.id], graph.floor[task.id]) == (duration, floor):
+            continue
+        graph.set_task(task.id, duration, floor)
+        touched.add(task.id)
+    touched |= graph.update(set(forward) | touched, set(backward) | touched)
+    save_schedule(project_id, graph, touched, new_ids)
+    return graph
+
+def rebuild_schedules():
+    """Recompute every project's schedule from its tasks and dependencies; returns the number of tasks scheduled."""
+    anchors = {project.id: schedule_anchor(project)
+               for project in db.session.query(Project.id, Project.start_date, Project.created_at)}
+    graphs = {}
+    tasks = db.session.query(Task.id, Task.project_id, Task.status, Task.start_date, Task.end_date)
+    for task in tasks.yield_per(5000):
+        if task.project_id in anchors:
+            graphs.setdefault(task.project_id, CriticalPath()).set_task(
+                task.id, task_duration(task), task_floor(task, anchors[task.project_id]))
+    for project_id, task_id, depends_on_id in db.session.query(
+            TaskDependency.project_id, TaskDependency.task_id, TaskDependency.depends_on_id):
+        graphs[project_id].add_edge(task_id, depends_on_id)
+    TaskSchedule.query.delete()
+    for project_id, graph in graphs.items():
+        graph.update(graph.duration, graph.duration)
+        save_schedule(project_id, graph, graph.duration, graph.duration)
+    Project.query.filter(Project.id.in_(db.select(TaskSchedule.project_id))).update(
+        {Project.version: Project.version + 1, Project.updated_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return sum(len(graph.duration) for graph in graphs.values())
+
+@app.cli.command('recompute-schedule')
+def recompute_schedule_command():
+    """Rebuild every task's earliest start, slack and critical-path flag."""
+    scheduled = rebuild_schedules()
+    print(f"✅ Schedule recomputed for {scheduled} task(s)")
+
+# Employee workload
+WORKLOAD_STATUSES = ('not_started', 'in_progress', 'done')
+
+# Sunday to Thursday; Friday and Saturday are the weekend
+WORKING_DAYS_PER_WEEK = 5
+
+def week_start(day):
+    """The Sunday starting ``day``'s working week."""
+    return day - timedelta(days=(day.weekday() + 1) % 7)
+
+def task_week_effort(task):
+    """{week start: working days of the task in that week} over its date range; empty once done or without dates."""
+    if task.status == 'done' or not (task.start_date and task.end_date) or task.end_date < task.start_date:
+        return {}
+    effort, day = {}, task.start_date
+    while day <= task.end_date:
+        week = week_start(day)
+        last = min(task.end_date, week + timedelta(days=6))
+        days = min((last - week).days, WORKING_DAYS_PER_WEEK - 1) - (day - week).days + 1
+        if days > 0:
+            effort[week] = days
+        day = last + timedelta(days=1)
+    return effort
+
+def workload_of(tasks):
+    """What ``tasks`` add to their assignees' workload: Counters keyed by (user, status) and (user, week start)."""
+    counts, effort = Counter(), Counter()
+    for task in tasks:
+        if task.assigned_to and task.status in WORKLOAD_STATUSES:
+            counts[task.assigned_to, task.status] += 1
+            for week, days in task_week_effort(task).items():
+                effort[task.assigned_to, week] += days
+    return counts, effort
+
+def apply_workload(added, removed=(Counter(), Counter())):
+    """Add one workload_of() result and subtract another inside the caller's transaction."""
+    counts, effort = Counter(added[0]), Counter(added[1])
+    counts.subtract(removed[0])
+    effort.subtract(removed[1])
+    by_user = defaultdict(dict)
+    for (user_id, status), delta in counts.items():
+        if delta:
+            by_user[user_id][status] = delta
+    for user_id, deltas in by_user.items():
+        increment_row(EmployeeWorkload, {'user_id': user_id}, **deltas)
+    increment_rows(EmployeeWeeklyEffort, ('user_id', 'week_start'), 'effort_days', effort)
+    # Unassigned tasks and edits that leave the counts alone keep the employees page valid
+    if by_user or any(effort.values()):
+        bump_stamp('workload')
+
+def rebuild_workload():
+    """Rebuild every employee's task counts and weekly effort from the tasks; returns the number of employees."""
+    counts, effort = Counter(), Counter()
+    tasks = db.session.query(Task.assigned_to, Task.status, Task.start_date, Task.end_date).filter(Task.assigned_to.isnot(None))
+    for task in tasks.yield_per(5000):
+        task_counts, task_effort = workload_of([task])
+        counts.update(task_counts)
+        effort.update(task_effort)
+    EmployeeWorkload.query.delete()
+    EmployeeWeeklyEffort.query.delete()
+    by_user = defaultdict(dict)
+    for (user_id, status), count in counts.items():
+        by_user[user_id][status] = count
+    if by_user:
+        db.session.execute(db.insert(EmployeeWorkload), [
+            {'user_id': user_id, **{status: row.get(status, 0) for status in WORKLOAD_STATUSES}} for user_id, row in by_user.items()])
+    if effort:
+        db.session.execute(db.insert(EmployeeWeeklyEffort), [
+            {'user_id': user_id, 'week_start': week, 'effort_days': days} for (user_id, week), days in effort.items()])
+    bump_stamp('workload')
+    db.session.commit()
+    return len(by_user)
+
+@app.cli.command('rebuild-workload')
+def rebuild_workload_command():
+    """Backfill employee task counts and weekly effort from tasks."""
+    employees = rebuild_workload()
+    print(f"✅ Workload rebuilt for {employees} employee(s)")
+
+# Project versions and rendered fragment cache
+def bump_project_version(project_id):
+    """Invalidate cached fragments of a project; runs in the caller's transaction."""
+    Project.query.filter_by(id=project_id).update(
+        {Project.version: Project.version + 1, Project.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+class FragmentCache:
+    """Size-bounded LRU of rendered HTML, optionally shared between workers through a SQLite file."""
+    
+    def __init__(self, max_entries=1000, shared_path=None):
+        self.max_entries = max_entries
+        self.shared_path = shared_path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.shared_lock = threading.Lock()
+        self.conn, self.conn_pid = None, None
+        self.shared_writes = 0
+    
+    def shared(self):
+        """This process's connection to the shared file; callers hold shared_lock.
+        
+        One per process rather than per thread: under gevent thread-locals are per greenlet,
+        which would mean a new connection for every request.
+        """
+        if self.conn_pid != os.getpid():
+            # A connection inherited across fork must not be used by the child
+            conn = sqlite3.connect(self.shared_path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment (key TEXT PRIMARY KEY, html TEXT NOT NULL)')
+            self.conn, self.conn_pid = conn, os.getpid()
+        return self.conn
+    
+    def remember(self, key, html):
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                return html
+        if self.shared_path:
+            try:
+                with self.shared_lock:
+                    row = self.shared().execute('SELECT html FROM fragment WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row:
+                self.remember(key, row[0])
+                return row[0]
+        return None
+    
+    def set(self, key, html):
+        self.remember(key, html)
+        if self.shared_path:
+            try:
+                with self.shared_lock:
+                    conn = self.shared()
+                    conn.execute('INSERT OR REPLACE INTO fragment (key, html) VALUES (?, ?)', (key, html))
+                    self.shared_writes += 1
+                    if self.shared_writes % 100 == 0:
+                        # Keys embed the project version, so the oldest rows are the stale ones
+                        conn.execute('DELETE FROM fragment WHERE rowid <= (SELECT max(rowid) FROM fragment) - ?',
+                                     (self.max_entries * 10,))
+            except sqlite3.Error:
+                pass
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_PATH'])
+
+def cached_fragment(key, render):
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render()
+        fragment_cache.set(key, html)
+    return Markup(html)
+
+# Change feed
+CHANGE_KINDS = {'Project': 'project', 'PurchaseRequest': 'purchase', 'Invoice': 'invoice'}
+
+def record_change(item):
+    """Append ``item`` to the change feed in the caller's transaction."""
+    if item.id is None:
+        db.session.flush()
+    db.session.add(ChangeEvent(kind=CHANGE_KINDS[type(item).__name__], ref_id=item.id))
+
+def record_changes(kind, ids):
+    if ids:
+        db.session.execute(db.insert(ChangeEvent), [{'kind': kind, 'ref_id': ref_id} for ref_id in ids])
+
+def last_change_id():
+    return db.session.scalar(db.select(db.func.max(ChangeEvent.id))) or 0
+
+# Ids are taken at insert but show up at commit. SQLite serialises writers, so they show up in
+# order; on server databases a transaction holding id N can commit after N+1. Readers therefore
+# treat the newest CHANGE_FEED_REORDER_WINDOW ids as still filling in.
+
+def feed_position():
+    """(newest id, entries among the newest window of ids, newest created_at) of the change feed.
+    
+    The count moves when an entry commits below the newest id, which the newest id alone would miss.
+    """
+    floor = db.select(db.func.max(ChangeEvent.id) - app.config['CHANGE_FEED_REORDER_WINDOW']).scalar_subquery()
+    newest, recent, created_at = db.session.query(
+        db.func.max(ChangeEvent.id), db.func.count(ChangeEvent.id), db.func.max(ChangeEvent.created_at)
+    ).filter(ChangeEvent.id > floor).one()
+    return newest or 0, recent, created_at
+
+def feed_cursor(last_id):
+    """(watermark, ids above it already seen) for a reader that has everything committed up to ``last_id``.
+    
+    Ids in the reorder window that are missing may still commit, so the watermark starts below them.
+    """
+    after = max(last_id - app.config['CHANGE_FEED_REORDER_WINDOW'], 0)
+    seen = {event_id for event_id, in db.session.query(ChangeEvent.id).filter(ChangeEvent.id > after, ChangeEvent.id <= last_id)}
+    return after, seen
+
+@app.cli.command('prune-change-feed')
+def prune_change_feed_command():
+    """Delete change feed entries older than CHANGE_FEED_RETENTION_DAYS."""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['CHANGE_FEED_RETENTION_DAYS'])
+    # Keep the newest entry so feed_position() never moves backwards; dashboard ETags are built on it
+    deleted = ChangeEvent.query.filter(ChangeEvent.created_at < cutoff, ChangeEvent.id < last_change_id()).delete(
+        synchronize_session=False)
+    db.session.commit()
+    print(f"✅ Deleted {deleted} change feed entries older than {app.config['CHANGE_FEED_RETENTION_DAYS']} days")
+
+# Conditional page requests
+# Stamps bumped by every write that changes the pages built from them
+STAMPS = ('users', 'suppliers', 'workload')
+
+def bump_stamp(name):
+    """Record a change to ``name`` in the caller's transaction (init_db creates the rows)."""
+    VersionStamp.query.filter_by(name=name).update(
+        {VersionStamp.version: VersionStamp.version + 1, VersionStamp.updated_at: datetime.utcnow()},
+        synchronize_session=False)
+
+def read_stamps(*names):
+    """(versions, newest updated_at) of the named stamps with one primary-key query."""
+    rows = {row.name: row for row in VersionStamp.query.filter(VersionStamp.name.in_(names))}
+    versions = [rows[name].version if name in rows else 0 for name in names]
+    return versions, max((row.updated_at for row in rows.values() if row.updated_at), default=None)
+
+@lru_cache(maxsize=None)
+def file_digest(path, mtime_ns):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
+
+def static_fingerprint(filename):
+    """Content hash of a file under static/, or None if there is no such file."""
+    path = safe_join(app.static_folder, filename)
+    try:
+        return file_digest(path, os.stat(path).st_mtime_ns)
+    except (TypeError, OSError):
+        return None
+
+@lru_cache(maxsize=None)
+def asset_version():
+    """Digest of the deployed templates and static files, so cached pages expire with a release."""
+    paths = []
+    for folder in (app.template_folder, app.static_folder):
+        for directory, _, files in os.walk(os.path.join(app.root_path, folder)):
+            paths.extend(os.path.join(directory, name) for name in files)
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, app.root_path).encode())
+        digest.update(file_digest(path, os.stat(path).st_mtime_ns).encode())
+    return digest.hexdigest()[:12]
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Give url_for('static', ...) a ``v=<content hash>`` argument, so every version of a file has its own URL."""
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = static_fingerprint(values.get('filename', ''))
+        if fingerprint:
+            values['v'] = fingerprint
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    # A fingerprinted URL always names the same bytes, so browsers may keep it without revalidating
+    if request.endpoint == 'static' and response.status_code in (200, 304) and request.args.get('v') and \
+            request.args.get('v') == static_fingerprint(request.view_args.get('filename', '')):
+        response.headers['Cache-Control'] = f"public, max-age={app.config['STATIC_MAX_AGE']}, immutable"
+    return response
+
+def page_etag(*stamps):
+    """Weak ETag of the requested page for the signed-in viewer, built from version stamps instead of the body."""
+    key = [asset_version(), session.get('user_id'), session.get('role'), request.full_path, *stamps]
+    return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+
+def not_modified(etag, last_modified=None):
+    """A 304 response when the client already holds this version of the page, else None so the caller renders it."""
+    # Flashed messages are shown by the next render, so a pending one always needs the full page
+    if '_flashes' in session or is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return tag_page(Response(status=304), etag, last_modified)
+
+def tag_page(body, etag, last_modified=None):
+    """Attach validators to a rendered page; browsers keep it but revalidate on every visit."""
+    response = make_response(body)
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Project activity
+def log_activity(project_id, action, ref_id=None, old_value=None, new_value=None):
+    """Append an entry to a project's timeline in the caller's transaction, attributed to the signed-in user."""
+    db.session.add(ProjectActivity(project_id=project_id, user_id=session.get('user_id'), action=action, ref_id=ref_id,
+                                   old_value=None if old_value is None else str(old_value),
+                                   new_value=None if new_value is None else str(new_value)))
+
+def backfill_activity():
+    """Seed the timeline of an existing database with project creations and comments."""
+    columns = ['project_id', 'user_id', 'action', 'ref_id', 'new_value', 'created_at']
+    db.session.execute(db.insert(ProjectActivity).from_select(columns, db.select(
+        Project.id, Project.created_by, db.literal('created'), Project.id, db.literal('pending_approval'), Project.created_at)))
+    db.session.execute(db.insert(ProjectActivity).from_select(columns, db.select(
+        Comment.project_id, Comment.user_id, db.literal('comment'), Comment.id, db.null(), Comment.created_at)))
+    db.session.commit()
+
+# Columns added after the first release; create_all() does not alter existing tables
+MIGRATION_COLUMNS = [
+    ('project', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('project', 'updated_at', 'DATETIME'),
+]
+
+def add_missing_columns():
+    inspector = db.inspect(db.engine)
+    for table, column, ddl in MIGRATION_COLUMNS:
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+# Password hashing
+def hash_password(password):
+    return generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
+
+def hash_passwords(passwords):
+    """Hash a batch of passwords, spread over a process pool when there is more than one."""
+    workers = min(app.config['HASH_WORKERS'], len(passwords))
+    if workers <= 1:
+        return [hash_password(password) for password in passwords]
+    hasher = partial(generate_password_hash, method=app.config['PASSWORD_HASH_METHOD'])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(hasher, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+@lru_cache(maxsize=None)
+def hash_prefix(method):
+    # Werkzeug fills in default parameters (e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000'), so ask it once
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != hash_prefix(app.config['PASSWORD_HASH_METHOD'])
+
+# Logins hash on a small pool so a login spike cannot occupy every request thread
+@lru_cache(maxsize=None)
+def login_pool():
+    """Create the pool and its queue slots on first use, i.e. inside the worker after any monkey-patching."""
+    workers = app.config['LOGIN_HASH_WORKERS']
+    try:
+        from gevent import monkey
+        patched = monkey.is_module_patched('threading')
+    except ImportError:
+        patched = False
+    if patched:
+        # Patched threads are greenlets; hashing there would stall every connection of the worker
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        pool = NativeThreadPoolExecutor(max_workers=workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+    return pool, threading.BoundedSemaphore(workers + app.config['LOGIN_QUEUE_SIZE'])
+
+def run_on_login_pool(function, *args):
+    """Run ``function`` on the login pool; returns None if the pool's queue stays full past LOGIN_QUEUE_TIMEOUT."""
+    pool, slots = login_pool()
+    if not slots.acquire(timeout=app.config['LOGIN_QUEUE_TIMEOUT']):
+        return None
+    try:
+        return pool.submit(function, *args).result()
+    finally:
+        slots.release()
 
 # Initialize database
 def init_db():
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        
+        # create_all() skips tables that already exist, so add indexes missing from older databases
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
         
         if User.query.count() == 0:
-            users = [
-                User(username='master', password=generate_password_hash('admin123'), role='master', department='الإدارة العامة', full_name='المدير العام'),
-                User(username='sales', password=generate_password_hash('sales123'), role='sales', department='المبيعات', full_name='موظف المبيعات'),
-                User(username='manager', password=generate_password_hash('manager123'), role='management', department='الإدارة العليا', full_name='المدير التنفيذي'),
-                User(username='projects', password=generate_password_hash('projects123'), role='projects', department='إدارة المشاريع', full_name='مدير المشاريع'),
-                User(username='operations', password=generate_password_hash('operations123'), role='operations', department='التشغيل', full_name='مدير التشغيل'),
-                User(username='procurement', password=generate_password_hash('procurement123'), role='procurement', department='المشتريات', full_name='مدير المشتريات'),
-                User(username='finance', password=generate_password_hash('finance123'), role='finance', department='المالية', full_name='المدير المالي'),
-                User(username='hr', password=generate_password_hash('hr123'), role='hr', department='الموارد البشرية', full_name='مدير الموارد البشرية'),
+            seed = [
+                ('master', 'admin123', 'master', 'الإدارة العامة', 'المدير العام'),
+                ('sales', 'sales123', 'sales', 'المبيعات', 'موظف المبيعات'),
+                ('manager', 'manager123', 'management', 'الإدارة العليا', 'المدير التنفيذي'),
+                ('projects', 'projects123', 'projects', 'إدارة المشاريع', 'مدير المشاريع'),
+                ('operations', 'operations123', 'operations', 'التشغيل', 'مدير التشغيل'),
+                ('procurement', 'procurement123', 'procurement', 'المشتريات', 'مدير المشتريات'),
+                ('finance', 'finance123', 'finance', 'المالية', 'المدير المالي'),
+                ('hr', 'hr123', 'hr', 'الموارد البشرية', 'مدير الموارد البشرية'),
             ]
+            hashes = hash_passwords([password for _, password, _, _, _ in seed])
+            users = [User(username=username, password=password_hash, role=role, department=department, full_name=full_name)
+                     for (username, _, role, department, full_name), password_hash in zip(seed, hashes)]
             db.session.add_all(users)
             db.session.commit()
             print("✅ Users created successfully!")
+        
+        ensure_search_index()
+        
+        existing = {name for name, in db.session.query(VersionStamp.name)}
+        db.session.add_all(VersionStamp(name=name, version=0) for name in STAMPS if name not in existing)
+        db.session.commit()
+        
+        if ProjectActivity.query.first() is None and Project.query.first() is not None:
+            backfill_activity()
+        
+        if ProjectStatusCount.query.count() == 0 and Project.query.count() > 0:
+            rebuild_status_counts()
+        
+        if ProjectProgress.query.count() == 0 and Task.query.count() > 0:
+            recompute_progress()
+        
+        if TaskSchedule.query.first() is None and Task.query.first() is not None:
+            rebuild_schedules()
+        
+        if EmployeeWorkload.query.first() is None and Task.query.filter(Task.assigned_to.isnot(None)).first() is not None:
+            rebuild_workload()
+        
+        if ProjectLedger.query.count() == 0 and Invoice.query.count() + PurchaseRequest.query.count() > 0:
+            rebuild_ledger()
+
+# Keyset pagination
+def encode_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_page(query, model, cursor=None, page_size=None):
+    """Return one page of ``query`` newest first, seeking past ``cursor`` on (created_at, id)."""
+    page_size = page_size or app.config['PAGE_SIZE']
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        created_at, row_id = after
+        query = query.filter(or_(model.created_at < created_at,
+                                 and_(model.created_at == created_at, model.id < row_id)))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+# Request instrumentation
+slow_query_log = logging.getLogger('app.slow_query')
+
+class Metrics:
+    """Per-endpoint histograms rendered in Prometheus text format.
+    
+    With METRICS_DIR set, every worker writes its snapshot to a file there
+    and /metrics sums the files, so any gunicorn worker can serve the scrape.
+    Files of exited workers stay and keep counting until gunicorn.conf.py
+    clears the directory on the next start.
+    """
+    
+    HISTOGRAMS = {
+        'request_duration_seconds': ('Request wall time', [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]),
+        'sql_queries_per_request': ('SQL statements executed per request', [0, 1, 2, 5, 10, 20, 50, 100, 200]),
+        'sql_duration_seconds': ('Total SQL time per request', [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]),
+        'template_render_seconds': ('Total Jinja render time per request', [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1]),
+        'response_size_bytes': ('Response body size', [1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 1e7]),
+    }
+    
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.series = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = 0.0
+        self.pid, self.filename = None, None
+        self.pending = None
+    
+    def observe(self, name, endpoint, value):
+        buckets = self.HISTOGRAMS[name][1]
+        with self.lock:
+            series = self.series.setdefault(f'{name}|{endpoint}', {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0})
+            series['buckets'][next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.series))
+    
+    def flush(self, force=False):
+        if not self.directory:
+            return
+        if not force and time.monotonic() - self.last_flush < self.flush_interval:
+            # Write the rest later, or a worker that goes idle would keep its last requests out of every scrape
+            with self.lock:
+                if self.pending is None:
+                    self.pending = threading.Timer(self.flush_interval, self.flush, kwargs={'force': True})
+                    self.pending.daemon = True
+                    self.pending.start()
+            return
+        with self.lock:
+            self.pending = None
+        with self.flush_lock:
+            self.last_flush = time.monotonic()
+            if self.pid != os.getpid():
+                # Named per process, not per pid: a recycled worker reusing a pid must not replace an exited one's counts
+                self.pid = os.getpid()
+                self.filename = f'metrics-{self.pid}-{time.time_ns()}.json'
+            path = os.path.join(self.directory, self.filename)
+            with open(path + '.tmp', 'w') as handle:
+                json.dump(self.snapshot(), handle)
+            os.replace(path + '.tmp', path)
+    
+    def collect(self):
+        """Sum this worker's series with every other worker's last flushed snapshot."""
+        if not self.directory:
+            return self.snapshot()
+        self.flush(force=True)
+        merged = {}
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as handle:
+                    worker = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for key, series in worker.items():
+                total = merged.setdefault(key, {'buckets': [0] * len(series['buckets']), 'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], series['buckets'])]
+                total['sum'] += series['sum']
+                total['count'] += series['count']
+        return merged
+    
+    def render(self):
+        collected = self.collect()
+        lines = []
+        for name, (help_text, buckets) in self.HISTOGRAMS.items():
+            lines += [f'# HELP app_{name} {help_text}', f'# TYPE app_{name} histogram']
+            for key in sorted(k for k in collected if k.split('|', 1)[0] == name):
+                endpoint = key.split('|', 1)[1].replace('\\', '\\\\').replace('"', '\\"')
+                series, cumulative = collected[key], 0
+                for bound, count in zip([*buckets, '+Inf'], series['buckets']):
+                    cumulative += count
+                    lines.append(f'app_{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'app_{name}_sum{{endpoint="{endpoint}"}} {series["sum"]}')
+                lines.append(f'app_{name}_count{{endpoint="{endpoint}"}} {series["count"]}')
+        return '\n'.join(lines) + '\n'
+
+if app.config['METRICS_DIR']:
+    os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+metrics = Metrics(app.config['METRICS_DIR'])
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context() and 'request_started' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        if executemany:
+            parameters = f'{parameters[0]!r} and {len(parameters) - 1} more rows'
+        slow_query_log.warning('%.1f ms [%s] %s %s', elapsed * 1000,
+                               request.endpoint if has_request_context() else '-', statement, parameters)
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    if 'request_started' in g:
+        g.render_started.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_render(sender, template, context, **extra):
+    if 'request_started' in g and g.render_started:
+        started = g.render_started.pop()
+        # Only the outermost render counts, so nested renders are not added twice
+        if not g.render_started:
+            g.render_time += time.perf_counter() - started
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_count, g.sql_time, g.render_time, g.render_started = 0, 0.0, 0.0, []
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('request_duration_seconds', endpoint, time.perf_counter() - g.request_started)
+    metrics.observe('sql_queries_per_request', endpoint, g.sql_count)
+    metrics.observe('sql_duration_seconds', endpoint, g.sql_time)
+    metrics.observe('template_render_seconds', endpoint, g.render_time)
+    if not response.is_streamed:
+        metrics.observe('response_size_bytes', endpoint, response.calculate_content_length() or 0)
+    metrics.flush()
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Routes
 @app.route('/')
@@ -120,8 +1356,19 @@ def login():
         password = request.form.get('password')
         
         user = User.query.filter_by(username=username).first()
+        verified = run_on_login_pool(check_password_hash, user.password, password or '') if user else False
+        
+        if verified is None:
+            flash('الخادم مشغول حالياً، يرجى المحاولة بعد قليل', 'error')
+            return render_template('login.html'), 503
         
-        if user and check_password_hash(user.password, password):
+        if verified:
+            if needs_rehash(user.password):
+                # Upgrade to the configured scheme while the plain password is at hand
+                new_hash = run_on_login_pool(hash_password, password)
+                if new_hash:
+                    user.password = new_hash
+                    db.session.commit()
             session['user_id'] = user.id
             session['username'] = user.username
             session['role'] = user.role
@@ -139,6 +1386,35 @@ def logout():
     flash('تم تسجيل الخروج بنجاح', 'success')
     return redirect(url_for('login'))
 
+# What each role's dashboard lists; None when the role does not see that list at all
+def dashboard_projects(role, user_id):
+    if role == 'master':
+        return Project.query
+    elif role == 'sales':
+        return Project.query.filter_by(created_by=user_id)
+    elif role == 'management':
+        return Project.query.filter_by(status='pending_approval')
+    return Project.query.filter(Project.status.in_(['approved', 'in_progress', 'completed', 'on_hold']))
+
+def dashboard_purchases(role, user_id):
+    if role == 'operations':
+        return PurchaseRequest.query.filter_by(requested_by=user_id)
+    if role in ['procurement', 'master']:
+        return PurchaseRequest.query
+    return None
+
+def dashboard_invoices(role, user_id):
+    return Invoice.query if role in ['finance', 'master'] else None
+
+def dashboard_stats():
+    status_counts = get_status_counts()
+    return {
+        'total': sum(status_counts.values()),
+        'pending': status_counts.get('pending_approval', 0),
+        'in_progress': status_counts.get('in_progress', 0),
+        'completed': status_counts.get('completed', 0)
+    }
+
 @app.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
@@ -147,41 +1423,155 @@ def dashboard():
     role = session.get('role')
     user_id = session.get('user_id')
     
-    total_projects = Project.query.count()
-    pending_projects = Project.query.filter_by(status='pending_approval').count()
-    in_progress = Project.query.filter_by(status='in_progress').count()
-    completed = Project.query.filter_by(status='completed').count()
+    # Read before the lists so the live feed replays anything that changes while they load; every change to
+    # what the dashboard lists lands in the feed, so the newest entry also validates the page
+    last_event_id, recent_events, last_event_at = feed_position()
+    # The counters are part of the tag because reconcile-status-counts rewrites them without a feed entry
+    stats = dashboard_stats()
+    etag = page_etag(last_event_id, recent_events, stats)
+    # The newest created_at cannot see an entry that commits late, so it only validates on SQLite
+    if db.engine.dialect.name != 'sqlite':
+        last_event_at = None
+    cached = not_modified(etag, last_event_at)
+    if cached:
+        return cached
     
-    if role == 'master':
-        projects = Project.query.order_by(Project.created_at.desc()).all()
-    elif role == 'sales':
-        projects = Project.query.filter_by(created_by=user_id).order_by(Project.created_at.desc()).all()
-    elif role == 'management':
-        projects = Project.query.filter_by(status='pending_approval').order_by(Project.created_at.desc()).all()
-    else:
-        projects = Project.query.filter(Project.status.in_(['approved', 'in_progress', 'completed', 'on_hold'])).order_by(Project.created_at.desc()).all()
+    projects, projects_next = keyset_page(dashboard_projects(role, user_id), Project, request.args.get('projects_after'))
     
-    purchase_requests = []
-    if role in ['procurement', 'master', 'operations']:
-        if role == 'operations':
-            purchase_requests = PurchaseRequest.query.filter_by(requested_by=user_id).all()
-        else:
-            purchase_requests = PurchaseRequest.query.all()
+    purchase_requests, purchases_next = [], None
+    purchases_query = dashboard_purchases(role, user_id)
+    if purchases_query is not None:
+        purchase_requests, purchases_next = keyset_page(purchases_query, PurchaseRequest, request.args.get('purchases_after'))
     
-    invoices = []
-    if role in ['finance', 'master']:
-        invoices = Invoice.query.all()
+    invoices, invoices_next = [], None
+    invoices_query = dashboard_invoices(role, user_id)
+    if invoices_query is not None:
+        invoices, invoices_next = keyset_page(invoices_query, Invoice, request.args.get('invoices_after'))
     
-    return render_template('dashboard.html', 
+    def load_more_url(param, cursor):
+        if not cursor:
+            return None
+        args = request.args.to_dict()
+        args[param] = cursor
+        return url_for('dashboard', **args)
+    
+    return tag_page(render_template('dashboard.html', 
                          projects=projects,
                          purchase_requests=purchase_requests,
                          invoices=invoices,
-                         stats={
-                             'total': total_projects,
-                             'pending': pending_projects,
-                             'in_progress': in_progress,
-                             'completed': completed
-                         })
+                         exports=[kind for kind, spec in EXPORTS.items() if role in spec['roles']],
+                         last_event_id=last_event_id,
+                         load_more={
+                             'projects': load_more_url('projects_after', projects_next),
+                             'purchases': load_more_url('purchases_after', purchases_next),
+                             'invoices': load_more_url('invoices_after', invoices_next)
+                         },
+                         stats=stats), etag, last_event_at)
+
+# Live dashboard updates
+# kind -> (dashboard query for a role, model, partial template, template variable)
+LIVE_LISTS = {
+    'project': (dashboard_projects, Project, 'partials/dashboard_project.html', 'project'),
+    'purchase': (dashboard_purchases, PurchaseRequest, 'partials/dashboard_purchase.html', 'purchase'),
+    'invoice': (dashboard_invoices, Invoice, 'partials/dashboard_invoice.html', 'invoice'),
+}
+
+def sse_message(event_id, event=None, data=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    if event:
+        lines += [f'event: {event}', f'data: {json.dumps(data, ensure_ascii=False)}']
+    return '\n'.join(lines) + '\n\n'
+
+def change_messages(events, role, user_id):
+    """Turn a batch of change events into SSE messages carrying the rows as this viewer's dashboard renders them."""
+    latest = {}
+    for change in events:
+        latest[(change.kind, change.ref_id)] = change.id
+    messages = []
+    for kind, (list_query, model, template, name) in LIVE_LISTS.items():
+        ids = [ref_id for (change_kind, ref_id) in latest if change_kind == kind]
+        query = list_query(role, user_id)
+        if not ids or query is None:
+            continue
+        visible = {item.id: item for item in query.filter(model.id.in_(ids))}
+        for ref_id in ids:
+            # Rows that left this viewer's list (e.g. approved while management watches) are removed
+            html = render_template(template, **{name: visible[ref_id]}) if ref_id in visible else None
+            messages.append((latest[(kind, ref_id)], kind, {'id': ref_id, 'html': html}))
+    if role in ['master', 'management'] and any(kind == 'project' for kind, _ in latest):
+        messages.append((max(latest.values()), 'stats', dashboard_stats()))
+    # No ids: the stream sends its resume watermark separately, after the batch
+    return [sse_message(None, kind, data) for _, kind, data in sorted(messages, key=lambda message: message[0])]
+
+@app.route('/events')
+def change_events():
+    """Server-Sent Events stream of dashboard rows changed by anyone, filtered to what this user's dashboard shows.
+    
+    Resumes after the Last-Event-ID header (sent by browsers on reconnect) or ?after=; each
+    connection ends after CHANGE_FEED_MAX_SECONDS and the browser reconnects on its own.
+    The id sent is a watermark: every entry at or below it was delivered, or its id stayed
+    unused for CHANGE_FEED_GAP_SECONDS (a rolled-back insert). Entries above it may be
+    delivered again after a reconnect, which only re-renders the same rows.
+    """
+    if 'user_id' not in session:
+        abort(401)
+    role, user_id = session.get('role'), session.get('user_id')
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    if last_id is None:
+        last_id = last_change_id()
+    poll = app.config['CHANGE_FEED_POLL_SECONDS']
+    
+    def generate():
+        yield f'retry: {int(poll * 3000)}\n\n'
+        deadline = time.monotonic() + app.config['CHANGE_FEED_MAX_SECONDS']
+        last_sent = time.monotonic()
+        after, seen = feed_cursor(last_id)
+        announced, stalled_since = last_id, None
+        while True:
+            query = ChangeEvent.query.filter(ChangeEvent.id > after)
+            if seen:
+                query = query.filter(ChangeEvent.id.notin_(seen))
+            events = query.order_by(ChangeEvent.id).limit(app.config['CHANGE_FEED_BATCH_SIZE']).all()
+            messages = change_messages(events, role, user_id) if events else []
+            # Do not hold a connection (or a SQLite read snapshot) while idle
+            db.session.close()
+            seen.update(event.id for event in events)
+            previous = after
+            while after + 1 in seen:
+                after += 1
+                seen.remove(after)
+            if seen:
+                # Ids below ones already delivered are missing; wait for them to commit or be given up
+                if after != previous or stalled_since is None:
+                    stalled_since = time.monotonic()
+                elif time.monotonic() - stalled_since >= app.config['CHANGE_FEED_GAP_SECONDS']:
+                    after = min(seen) - 1
+                    while after + 1 in seen:
+                        after += 1
+                        seen.remove(after)
+                    stalled_since = time.monotonic() if seen else None
+            else:
+                stalled_since = None
+            if after > announced:
+                announced = after
+                # A bare id moves the browser's Last-Event-ID past events this viewer does not see
+                messages.append(sse_message(after))
+            elif not messages and time.monotonic() - last_sent > 15:
+                # Comment line as keepalive, so proxies keep the connection and dead clients are noticed
+                messages.append(': keepalive\n\n')
+            if messages:
+                yield ''.join(messages)
+                last_sent = time.monotonic()
+            if time.monotonic() >= deadline:
+                break
+            # A full batch means more are waiting, so fetch again right away
+            if len(events) < app.config['CHANGE_FEED_BATCH_SIZE']:
+                time.sleep(poll)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/project/add', methods=['GET', 'POST'])
 def add_project():
@@ -205,6 +1595,9 @@ def add_project():
             status='pending_approval'
         )
         db.session.add(project)
+        count_status_change(None, project.status)
+        record_change(project)
+        log_activity(project.id, 'created', ref_id=project.id, new_value=project.status)
         db.session.commit()
         flash('تم إضافة المشروع بنجاح! في انتظار الاعتماد', 'success')
         return redirect(url_for('dashboard'))
@@ -217,29 +1610,73 @@ def project_details(project_id):
         return redirect(url_for('login'))
     
     project = Project.query.get_or_404(project_id)
-    tasks = Task.query.filter_by(project_id=project_id).all()
-    purchase_requests = PurchaseRequest.query.filter_by(project_id=project_id).all()
-    invoices = Invoice.query.filter_by(project_id=project_id).all()
-    comments = Comment.query.filter_by(project_id=project_id).order_by(Comment.created_at.desc()).all()
-    
-    # Get users for tasks
-    users = User.query.filter_by(is_active=True).all()
-    
-    # Get comment users
-    comment_users = {}
-    for comment in comments:
-        user = User.query.get(comment.user_id)
-        if user:
-            comment_users[comment.id] = user
-    
-    return render_template('project_details.html', 
+    can_update_tasks = session.get('role') in ['projects', 'master', 'operations']
+    can_edit_schedule = session.get('role') in ['projects', 'master']
+    key = f'project:{project.id}:v{project.version}'
+    
+    # Everything on the page is covered by the project's version, except the add-task form's user list
+    stamps, last_modified = [project.version], project.updated_at
+    if can_edit_schedule:
+        versions, users_changed = read_stamps('users')
+        stamps += versions
+        last_modified = max(filter(None, [last_modified, users_changed]), default=None)
+    etag = page_etag(*stamps)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    def render_tasks():
+        tasks = Task.query.filter_by(project_id=project_id).options(selectinload(Task.assignee)).all()
+        graph = load_critical_path(project_id)
+        anchor, finish = schedule_anchor(project), graph.finish()
+        schedule = {}
+        for task_id, duration in graph.duration.items():
+            start = anchor + timedelta(days=graph.earliest[task_id])
+            slack = graph.slack(task_id, finish)
+            schedule[task_id] = {'start': start, 'end': start + timedelta(days=max(duration - 1, 0)),
+                                 'slack': slack, 'critical': duration > 0 and slack == 0}
+        projected_end = anchor + timedelta(days=finish - 1) if finish else None
+        days_late = (projected_end - project.end_date).days if projected_end and project.end_date else 0
+        return render_template('partials/project_tasks.html', tasks=tasks, can_update_tasks=can_update_tasks,
+                               can_edit_schedule=can_edit_schedule, schedule=schedule, dependencies=graph.preds,
+                               projected_end=projected_end, days_late=days_late)
+    
+    def render_purchases():
+        purchase_requests = PurchaseRequest.query.filter_by(project_id=project_id).options(selectinload(PurchaseRequest.supplier)).all()
+        return render_template('partials/project_purchases.html', purchase_requests=purchase_requests)
+    
+    def render_invoices():
+        invoices = Invoice.query.filter_by(project_id=project_id).all()
+        return render_template('partials/project_invoices.html', invoices=invoices)
+    
+    activity_cursor = request.args.get('activity_after')
+    
+    def render_activity():
+        query = ProjectActivity.query.filter_by(project_id=project_id).options(
+            selectinload(ProjectActivity.user), selectinload(ProjectActivity.comment))
+        entries, next_cursor = keyset_page(query, ProjectActivity, activity_cursor, app.config['ACTIVITY_PAGE_SIZE'])
+        older_url = url_for('project_details', project_id=project_id, activity_after=next_cursor, _anchor='activity') if next_cursor else None
+        return render_template('partials/project_activity.html', entries=entries, older_url=older_url,
+                               newest_url=url_for('project_details', project_id=project_id, _anchor='activity') if activity_cursor else None)
+    
+    fragments = {
+        'header': cached_fragment(f'{key}:header', lambda: render_template('partials/project_header.html', project=project)),
+        'tasks': cached_fragment(f'{key}:tasks:{int(can_update_tasks)}{int(can_edit_schedule)}', render_tasks),
+        'purchases': cached_fragment(f'{key}:purchases', render_purchases),
+        'invoices': cached_fragment(f'{key}:invoices', render_invoices),
+        # Only the newest page is shared by every viewer; older pages are rendered on demand
+        'activity': Markup(render_activity()) if activity_cursor else cached_fragment(f'{key}:activity', render_activity),
+    }
+    
+    # Users for the add-task form
+    users = []
+    if session.get('role') in ['projects', 'master']:
+        users = User.query.filter_by(is_active=True).all()
+    
+    return tag_page(render_template('project_details.html', 
                          project=project,
-                         tasks=tasks,
-                         purchase_requests=purchase_requests,
-                         invoices=invoices,
-                         comments=comments,
-                         comment_users=comment_users,
-                         users=users)
+                         fragments=fragments,
+                         users=users), etag, last_modified)
 
 @app.route('/project/<int:project_id>/update_progress', methods=['POST'])
 def update_progress(project_id):
@@ -247,8 +1684,15 @@ def update_progress(project_id):
         return redirect(url_for('login'))
     
     project = Project.query.get_or_404(project_id)
+    if project.task_rollup and project.task_rollup.task_weight:
+        flash('نسبة الإنجاز تُحسب تلقائياً من المهام', 'error')
+        return redirect(url_for('project_details', project_id=project_id))
+    
     progress = int(request.form.get('progress', 0))
+    log_activity(project_id, 'progress', old_value=project.progress_percent, new_value=progress)
     project.progress_percent = progress
+    bump_project_version(project_id)
+    record_change(project)
     db.session.commit()
     flash(f'تم تحديث نسبة الإنجاز إلى {progress}%', 'success')
     return redirect(url_for('project_details', project_id=project_id))
@@ -260,7 +1704,10 @@ def approve_project(project_id):
         return redirect(url_for('dashboard'))
     
     project = Project.query.get_or_404(project_id)
-    project.status = 'approved'
+    if not set_project_status(project, 'approved'):
+        db.session.rollback()
+        flash('تم تغيير حالة المشروع من مستخدم آخر، يرجى المحاولة مرة أخرى', 'error')
+        return redirect(url_for('dashboard'))
     project.approved_by = session.get('user_id')
     db.session.commit()
     flash(f'تم اعتماد المشروع: {project.name}', 'success')
@@ -273,7 +1720,10 @@ def reject_project(project_id):
         return redirect(url_for('dashboard'))
     
     project = Project.query.get_or_404(project_id)
-    project.status = 'rejected'
+    if not set_project_status(project, 'rejected'):
+        db.session.rollback()
+        flash('تم تغيير حالة المشروع من مستخدم آخر، يرجى المحاولة مرة أخرى', 'error')
+        return redirect(url_for('dashboard'))
     db.session.commit()
     flash(f'تم رفض المشروع: {project.name}', 'error')
     return redirect(url_for('dashboard'))
@@ -289,7 +1739,10 @@ def update_project_status(project_id, status):
         return redirect(url_for('dashboard'))
     
     project = Project.query.get_or_404(project_id)
-    project.status = status
+    if not set_project_status(project, status):
+        db.session.rollback()
+        flash('تم تغيير حالة المشروع من مستخدم آخر، يرجى المحاولة مرة أخرى', 'error')
+        return redirect(url_for('dashboard'))
     db.session.commit()
     
     status_names = {
@@ -318,6 +1771,14 @@ def add_task(project_id):
         status='not_started'
     )
     db.session.add(task)
+    task.progress_percent = 0
+    rollup_task_change(task, 0, added=True)
+    apply_workload(workload_of([task]))
+    bump_project_version(project_id)
+    record_changes('project', [project_id])
+    db.session.flush()
+    schedule_new_tasks([task])
+    log_activity(project_id, 'task_added', ref_id=task.id, new_value=(task.name or '')[:50])
     db.session.commit()
     flash('تم إضافة المهمة بنجاح!', 'success')
     return redirect(url_for('project_details', project_id=project_id))
@@ -328,6 +1789,9 @@ def update_task_status(task_id, status):
         return redirect(url_for('login'))
     
     task = Task.query.get_or_404(task_id)
+    old_progress = task.progress_percent or 0
+    old_workload = workload_of([task])
+    log_activity(task.project_id, 'task_status', ref_id=task.id, old_value=task.status, new_value=status)
     task.status = status
     
     if status == 'done':
@@ -335,10 +1799,65 @@ def update_task_status(task_id, status):
     elif status == 'in_progress' and task.progress_percent == 0:
         task.progress_percent = 50
     
+    rollup_task_change(task, old_progress)
+    apply_workload(workload_of([task]), old_workload)
+    reschedule(task.project_id, [task.id])
+    bump_project_version(task.project_id)
+    record_changes('project', [task.project_id])
     db.session.commit()
     flash('تم تحديث حالة المهمة', 'success')
     return redirect(url_for('project_details', project_id=task.project_id))
 
+@app.route('/project/<int:project_id>/dependency/add', methods=['POST'])
+def add_task_dependency(project_id):
+    if 'user_id' not in session or session.get('role') not in ['projects', 'master']:
+        flash('ليس لديك صلاحية لتعديل اعتماديات المهام', 'error')
+        return redirect(url_for('dashboard'))
+    
+    task = db.session.get(Task, request.form.get('task_id', type=int) or 0)
+    depends_on = db.session.get(Task, request.form.get('depends_on_id', type=int) or 0)
+    if task is None or depends_on is None or task.id == depends_on.id or {task.project_id, depends_on.project_id} != {project_id}:
+        flash('يجب اختيار مهمتين مختلفتين من هذا المشروع', 'error')
+        return redirect(url_for('project_details', project_id=project_id))
+    
+    # Take the project's write lock before reading its graph, so concurrent edits are checked one at a time
+    bump_project_version(project_id)
+    graph = load_critical_path(project_id, forward=[task.id], backward=[depends_on.id])
+    if depends_on.id in graph.preds.get(task.id, ()):
+        db.session.rollback()
+        flash('هذه الاعتمادية موجودة مسبقاً', 'error')
+    elif graph.has_path(task.id, depends_on.id):
+        db.session.rollback()
+        flash('لا يمكن إضافة هذه الاعتمادية لأنها تُنشئ حلقة بين المهام', 'error')
+    else:
+        db.session.add(TaskDependency(task_id=task.id, depends_on_id=depends_on.id, project_id=project_id))
+        graph.add_edge(task.id, depends_on.id)
+        reschedule(project_id, forward=[task.id], backward=[depends_on.id], graph=graph)
+        log_activity(project_id, 'dependency_added', ref_id=task.id, new_value=depends_on.id)
+        db.session.commit()
+        flash('تم إضافة الاعتمادية وتحديث الجدول الزمني', 'success')
+    return redirect(url_for('project_details', project_id=project_id))
+
+@app.route('/task/<int:task_id>/dependency/<int:depends_on_id>/remove')
+def remove_task_dependency(task_id, depends_on_id):
+    if 'user_id' not in session or session.get('role') not in ['projects', 'master']:
+        flash('ليس لديك صلاحية لتعديل اعتماديات المهام', 'error')
+        return redirect(url_for('dashboard'))
+    
+    project_id = TaskDependency.query.get_or_404((task_id, depends_on_id)).project_id
+    bump_project_version(project_id)
+    # Another request may have removed it while this one waited for the project's write lock
+    if not TaskDependency.query.filter_by(task_id=task_id, depends_on_id=depends_on_id).delete(synchronize_session=False):
+        db.session.rollback()
+        return redirect(url_for('project_details', project_id=project_id))
+    graph = load_critical_path(project_id, forward=[task_id], backward=[depends_on_id])
+    graph.remove_edge(task_id, depends_on_id)
+    reschedule(project_id, forward=[task_id], backward=[depends_on_id], graph=graph)
+    log_activity(project_id, 'dependency_removed', ref_id=task_id, old_value=depends_on_id)
+    db.session.commit()
+    flash('تم حذف الاعتمادية وتحديث الجدول الزمني', 'success')
+    return redirect(url_for('project_details', project_id=project_id))
+
 # Comments Routes
 @app.route('/project/<int:project_id>/comment/add', methods=['POST'])
 def add_comment(project_id):
@@ -353,6 +1872,9 @@ def add_comment(project_id):
             comment_text=comment_text
         )
         db.session.add(comment)
+        db.session.flush()
+        log_activity(project_id, 'comment', ref_id=comment.id)
+        bump_project_version(project_id)
         db.session.commit()
         flash('تم إضافة التعليق بنجاح!', 'success')
     
@@ -378,6 +1900,9 @@ def add_purchase_request():
             status='pending'
         )
         db.session.add(purchase)
+        bump_project_version(purchase.project_id)
+        record_change(purchase)
+        log_activity(purchase.project_id, 'purchase_added', ref_id=purchase.id, new_value=purchase.estimated_cost)
         db.session.commit()
         flash('تم إضافة طلب الشراء بنجاح!', 'success')
         return redirect(url_for('dashboard'))
@@ -393,7 +1918,13 @@ def approve_purchase(purchase_id):
         return redirect(url_for('dashboard'))
     
     purchase = PurchaseRequest.query.get_or_404(purchase_id)
-    purchase.status = 'approved'
+    log_activity(purchase.project_id, 'purchase_status', ref_id=purchase.id, old_value=purchase.status, new_value='approved')
+    if not ledger_purchase_status(purchase, 'approved'):
+        db.session.rollback()
+        flash('تم تغيير حالة طلب الشراء من مستخدم آخر، يرجى المحاولة مرة أخرى', 'error')
+        return redirect(url_for('dashboard'))
+    bump_project_version(purchase.project_id)
+    record_change(purchase)
     db.session.commit()
     flash('تم اعتماد طلب الشراء', 'success')
     return redirect(url_for('dashboard'))
@@ -405,7 +1936,13 @@ def reject_purchase(purchase_id):
         return redirect(url_for('dashboard'))
     
     purchase = PurchaseRequest.query.get_or_404(purchase_id)
-    purchase.status = 'rejected'
+    log_activity(purchase.project_id, 'purchase_status', ref_id=purchase.id, old_value=purchase.status, new_value='rejected')
+    if not ledger_purchase_status(purchase, 'rejected'):
+        db.session.rollback()
+        flash('تم تغيير حالة طلب الشراء من مستخدم آخر، يرجى المحاولة مرة أخرى', 'error')
+        return redirect(url_for('dashboard'))
+    bump_project_version(purchase.project_id)
+    record_change(purchase)
     db.session.commit()
     flash('تم رفض طلب الشراء', 'error')
     return redirect(url_for('dashboard'))
@@ -429,6 +1966,10 @@ def add_invoice():
             created_by=session.get('user_id')
         )
         db.session.add(invoice)
+        ledger_invoice_created(invoice)
+        bump_project_version(invoice.project_id)
+        record_change(invoice)
+        log_activity(invoice.project_id, 'invoice_added', ref_id=invoice.id, new_value=invoice.amount)
         db.session.commit()
         flash('تم إضافة الفاتورة بنجاح!', 'success')
         return redirect(url_for('dashboard'))
@@ -443,11 +1984,368 @@ def mark_invoice_paid(invoice_id):
         return redirect(url_for('dashboard'))
     
     invoice = Invoice.query.get_or_404(invoice_id)
-    invoice.payment_status = 'paid'
+    log_activity(invoice.project_id, 'invoice_status', ref_id=invoice.id, old_value=invoice.payment_status, new_value='paid')
+    if not ledger_invoice_paid(invoice):
+        db.session.rollback()
+        flash('الفاتورة مدفوعة مسبقاً', 'error')
+        return redirect(url_for('dashboard'))
+    bump_project_version(invoice.project_id)
+    record_change(invoice)
     db.session.commit()
     flash('تم تحديث حالة الفاتورة إلى: مدفوعة', 'success')
     return redirect(url_for('dashboard'))
 
+# Bulk transitions API
+# kind -> target status -> roles allowed (None: any logged-in user, as in update_project_status)
+BULK_TRANSITIONS = {
+    'projects': {
+        'approved': ['management', 'master'],
+        'rejected': ['management', 'master'],
+        'in_progress': None,
+        'on_hold': None,
+        'completed': None,
+        'cancelled': None,
+    },
+    'purchases': {
+        'approved': ['procurement', 'master'],
+        'rejected': ['procurement', 'master'],
+    },
+    'invoices': {
+        'paid': ['finance', 'master'],
+    },
+}
+
+def bulk_rows(kind, ids):
+    """Fetch (id, project_id, current state, amount) for the requested ids in one query."""
+    if kind == 'projects':
+        columns = (Project.id, Project.id, Project.status, db.null())
+    elif kind == 'purchases':
+        columns = (PurchaseRequest.id, PurchaseRequest.project_id, PurchaseRequest.status, PurchaseRequest.estimated_cost)
+    else:
+        columns = (Invoice.id, Invoice.project_id, Invoice.payment_status, Invoice.amount)
+    return db.session.query(*columns).filter(columns[0].in_(ids)).all()
+
+def apply_bulk_transition(kind, rows, status):
+    """Move ``rows`` to ``status`` plus batched counter, ledger and version updates; returns the ids moved.
+    
+    Each UPDATE is guarded by the state the rows were read in, one statement per old state, so a row
+    another request moved in the meantime is left alone and only rows this request changed are counted.
+    """
+    model, column = {'projects': (Project, Project.status), 'purchases': (PurchaseRequest, PurchaseRequest.status),
+                     'invoices': (Invoice, Invoice.payment_status)}[kind]
+    values = {column: status}
+    if kind == 'projects' and status == 'approved':
+        values[Project.approved_by] = session.get('user_id')
+    by_state = defaultdict(list)
+    for row in rows:
+        by_state[row[2]].append(row[0])
+    moved_ids = set()
+    for old_status, ids in by_state.items():
+        moved_ids.update(db.session.execute(
+            db.update(model).where(model.id.in_(ids), column == old_status).values(values).returning(model.id),
+            execution_options={'synchronize_session': False}).scalars())
+    rows = [row for row in rows if row[0] in moved_ids]
+    if not rows:
+        return []
+    changed_ids = [row[0] for row in rows]
+    project_ids = {row[1] for row in rows if row[1] is not None}
+    if kind == 'projects':
+        moved = {status: len(rows)}
+        for row in rows:
+            moved[row[2]] = moved.get(row[2], 0) - 1
+        increment_rows(ProjectStatusCount, 'status', 'count', moved)
+    elif kind == 'purchases':
+        deltas = {}
+        for _, project_id, old_status, cost in rows:
+            if old_status == 'approved' or status == 'approved':
+                amount = to_minor(cost)
+                deltas[project_id] = deltas.get(project_id, 0) + (amount if status == 'approved' else -amount)
+        increment_rows(ProjectLedger, 'project_id', 'approved_purchases', deltas)
+    else:
+        paid = {}
+        for _, project_id, _, amount in rows:
+            paid[project_id] = paid.get(project_id, 0) + to_minor(amount)
+        increment_rows(ProjectLedger, 'project_id', 'paid', paid)
+    Project.query.filter(Project.id.in_(project_ids)).update(
+        {Project.version: Project.version + 1, Project.updated_at: datetime.utcnow()}, synchronize_session=False)
+    record_changes(kind[:-1], changed_ids)  # 'projects' -> 'project'
+    action = {'projects': 'status', 'purchases': 'purchase_status', 'invoices': 'invoice_status'}[kind]
+    db.session.execute(db.insert(ProjectActivity), [
+        {'project_id': project_id, 'user_id': session.get('user_id'), 'action': action,
+         'ref_id': row_id, 'old_value': old_status, 'new_value': status}
+        for row_id, project_id, old_status, _ in rows if project_id is not None])
+    return changed_ids
+
+@app.route('/api/bulk/<kind>', methods=['POST'])
+def bulk_transition(kind):
+    """Apply one target state to a list of ids in a single transaction.
+    
+    Body: {"ids": [1, 2, 3], "status": "approved"}. Each id is reported as
+    "updated", "unchanged" (already in that state), "not_found" or "conflict"
+    (another request changed it while this one ran; nothing was applied to it).
+    """
+    if 'user_id' not in session:
+        return jsonify(error='يجب تسجيل الدخول'), 401
+    
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    ids = data.get('ids')
+    if kind not in BULK_TRANSITIONS or status not in BULK_TRANSITIONS[kind]:
+        return jsonify(error='حالة غير صحيحة'), 400
+    if not isinstance(ids, list) or not ids or len(ids) > app.config['BULK_MAX_ITEMS']:
+        return jsonify(error=f"يجب إرسال قائمة معرفات (حتى {app.config['BULK_MAX_ITEMS']})"), 400
+    try:
+        ids = list(dict.fromkeys(int(item_id) for item_id in ids))
+    except (TypeError, ValueError):
+        return jsonify(error='معرفات غير صحيحة'), 400
+    
+    roles = BULK_TRANSITIONS[kind][status]
+    if roles is not None and session.get('role') not in roles:
+        return jsonify(error='ليس لديك صلاحية لتنفيذ هذا الإجراء'), 403
+    
+    rows = {row[0]: row for row in bulk_rows(kind, ids)}
+    pending = [row for row in rows.values() if row[2] != status]
+    changed_ids = set()
+    if pending:
+        changed_ids = set(apply_bulk_transition(kind, pending, status))
+        db.session.commit()
+    
+    def result(item_id):
+        if item_id not in rows:
+            return 'not_found'
+        if item_id in changed_ids:
+            return 'updated'
+        return 'unchanged' if rows[item_id][2] == status else 'conflict'
+    
+    results = [{'id': item_id, 'result': result(item_id)} for item_id in ids]
+    return jsonify(status=status, updated=len(changed_ids), results=results)
+
+# CSV exports
+EXPORTS = {
+    'projects': {
+        'model': Project,
+        'columns': ['id', 'project_code', 'name', 'client_name', 'description', 'estimated_cost', 'start_date',
+                    'end_date', 'status', 'progress_percent', 'created_by', 'approved_by', 'created_at'],
+        'status': 'status', 'project': 'id',
+        'roles': ['master', 'management', 'finance', 'projects'],
+    },
+    'tasks': {
+        'model': Task,
+        'columns': ['id', 'project_id', 'name', 'description', 'assigned_to', 'status', 'progress_percent',
+                    'start_date', 'end_date', 'created_at'],
+        'status': 'status', 'project': 'project_id',
+        'roles': ['master', 'projects', 'operations'],
+    },
+    'purchases': {
+        'model': PurchaseRequest,
+        'columns': ['id', 'project_id', 'requested_by', 'supplier_id', 'description', 'estimated_cost', 'status', 'created_at'],
+        'status': 'status', 'project': 'project_id',
+        'roles': ['master', 'procurement', 'finance'],
+    },
+    'invoices': {
+        'model': Invoice,
+        'columns': ['id', 'project_id', 'invoice_type', 'amount', 'payment_status', 'created_by', 'created_at'],
+        'status': 'payment_status', 'project': 'project_id',
+        'roles': ['master', 'finance'],
+    },
+    'suppliers': {
+        'model': Supplier,
+        'columns': ['id', 'name', 'contact_person', 'email', 'phone', 'address', 'is_active', 'created_at'],
+        'status': None, 'project': None,
+        'roles': ['master', 'procurement', 'finance'],
+    },
+}
+
+class CsvLine:
+    """File-like object that hands back what csv.writer writes instead of buffering it."""
+    def write(self, value):
+        return value
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400)
+
+@app.route('/export/<kind>.csv')
+def export_csv(kind):
+    """Stream a table as CSV in id-ordered batches, filtered by ?status=, ?project_id=, ?date_from= and ?date_to=."""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    spec = EXPORTS.get(kind)
+    if spec is None:
+        abort(404)
+    if session.get('role') not in spec['roles']:
+        flash('ليس لديك صلاحية لتصدير هذه البيانات', 'error')
+        return redirect(url_for('dashboard'))
+    
+    model = spec['model']
+    columns = [getattr(model, name) for name in spec['columns']]
+    filters = []
+    if spec['status'] and request.args.get('status'):
+        filters.append(getattr(model, spec['status']) == request.args['status'])
+    if spec['project'] and request.args.get('project_id'):
+        filters.append(getattr(model, spec['project']) == request.args.get('project_id', type=int))
+    date_from, date_to = parse_date_arg('date_from'), parse_date_arg('date_to')
+    if date_from:
+        filters.append(model.created_at >= date_from)
+    if date_to:
+        filters.append(model.created_at < date_to + timedelta(days=1))
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    
+    def generate():
+        writer = csv.writer(CsvLine())
+        # BOM so spreadsheet apps detect UTF-8 (Arabic text)
+        yield '\ufeff' + writer.writerow(spec['columns'])
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(*columns).where(model.id > last_id, *filters).order_by(model.id).limit(batch_size)).all()
+            # Release the connection between batches so a long download does not pin a read transaction
+            db.session.close()
+            if not rows:
+                break
+            yield ''.join(writer.writerow(row) for row in rows)
+            last_id = rows[-1][0]
+    
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%d')}.csv"
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# Reports
+@app.route('/reports/portfolio')
+def portfolio_report():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    if session.get('role') not in ['finance', 'management', 'master']:
+        flash('ليس لديك صلاحية لعرض التقارير المالية', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Totals cover the same projects as the list, so spend and budget compare like for like
+    in_portfolio = Project.status.notin_(['rejected', 'cancelled'])
+    projects_query = Project.query.filter(in_portfolio).options(selectinload(Project.ledger))
+    projects, next_cursor = keyset_page(projects_query, Project, request.args.get('after'))
+    
+    approved_purchases, invoiced, paid = db.session.query(
+        db.func.coalesce(db.func.sum(ProjectLedger.approved_purchases), 0),
+        db.func.coalesce(db.func.sum(ProjectLedger.invoiced), 0),
+        db.func.coalesce(db.func.sum(ProjectLedger.paid), 0)).join(Project, Project.id == ProjectLedger.project_id).filter(
+        in_portfolio).one()
+    budget = db.session.query(db.func.coalesce(db.func.sum(Project.estimated_cost), 0)).filter(in_portfolio).scalar()
+    
+    return render_template('portfolio.html',
+                         projects=projects,
+                         load_more=url_for('portfolio_report', after=next_cursor) if next_cursor else None,
+                         totals={
+                             'budget': to_minor(budget),
+                             'approved_purchases': approved_purchases,
+                             'invoiced': invoiced,
+                             'paid': paid,
+                             'outstanding': invoiced - paid
+                         })
+
+# Full-text search
+# kind -> (source table, rowid slot, title expression, body expression, project id expression, columns that feed the index)
+SEARCH_SOURCES = {
+    'project': ('project', 0, "new.name",
+                "coalesce(new.project_code, '') || ' ' || coalesce(new.client_name, '') || ' ' || coalesce(new.description, '')",
+                "new.id", 'name, project_code, client_name, description'),
+    'task': ('task', 1, "new.name", "coalesce(new.description, '')", "new.project_id", 'name, description'),
+    'comment': ('comment', 2, "''", "new.comment_text", "new.project_id", 'comment_text'),
+    'supplier': ('supplier', 3, "new.name",
+                 "coalesce(new.contact_person, '') || ' ' || coalesce(new.email, '') || ' ' || coalesce(new.phone, '') || ' ' || coalesce(new.address, '')",
+                 "NULL", 'name, contact_person, email, phone, address'),
+}
+
+def search_available():
+    return db.engine.dialect.name == 'sqlite'
+
+def search_index_ddl():
+    """FTS5 table plus triggers that keep it in sync; rowid = source id * 4 + slot."""
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "title, body, kind UNINDEXED, ref_id UNINDEXED, project_id UNINDEXED, tokenize='trigram')"
+    ]
+    for kind, (table, slot, title, body, project_id, columns) in SEARCH_SOURCES.items():
+        insert = (f"INSERT INTO search_index (rowid, title, body, kind, ref_id, project_id) "
+                  f"VALUES (new.id * 4 + {slot}, {title}, {body}, '{kind}', new.id, {project_id});")
+        delete = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {slot};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE OF {columns} ON {table} BEGIN {delete} {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        ]
+    return statements
+
+def rebuild_search_index():
+    """Repopulate the FTS index from the source tables; returns the number of indexed rows."""
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM search_index")
+        for kind, (table, slot, title, body, project_id, _) in SEARCH_SOURCES.items():
+            values = ', '.join(expression.replace('new.', f'{table}.') for expression in (title, body, project_id))
+            conn.exec_driver_sql(
+                f"INSERT INTO search_index (rowid, title, body, project_id, kind, ref_id) "
+                f"SELECT id * 4 + {slot}, {values}, '{kind}', id FROM {table}")
+        return conn.exec_driver_sql("SELECT count(*) FROM search_index").scalar()
+
+def ensure_search_index():
+    if not search_available():
+        return
+    exists = db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).scalar()
+    with db.engine.begin() as conn:
+        for statement in search_index_ddl():
+            conn.exec_driver_sql(statement)
+    if not exists:
+        rebuild_search_index()
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text search index over projects, tasks, comments and suppliers."""
+    print(f"✅ Indexed {rebuild_search_index()} rows")
+
+def highlight(snippet):
+    # snippet() marks matches with control characters so the text itself can be escaped safely
+    return Markup(str(Markup.escape(snippet)).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+@app.route('/search')
+def search():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    query = (request.args.get('q') or '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = app.config['SEARCH_PAGE_SIZE']
+    kinds = ['project', 'task', 'comment']
+    if session.get('role') in ['procurement', 'master']:
+        kinds.append('supplier')
+    results, has_more = [], False
+    
+    if query and not search_available():
+        flash('البحث غير متاح على قاعدة البيانات الحالية', 'error')
+    elif query and len(query) < 3:
+        flash('يرجى إدخال ثلاثة أحرف على الأقل للبحث', 'error')
+    elif query:
+        kind_params = {f'kind{i}': kind for i, kind in enumerate(kinds)}
+        rows = db.session.execute(db.text(
+            "SELECT kind, ref_id, project_id, title, "
+            "snippet(search_index, -1, char(2), char(3), '…', 48) AS snippet "
+            "FROM search_index WHERE search_index MATCH :match "
+            f"AND kind IN ({', '.join(':' + name for name in kind_params)}) "
+            "ORDER BY bm25(search_index, 10.0, 1.0) LIMIT :limit OFFSET :offset"),
+            {'match': '"' + query.replace('"', '""') + '"', 'limit': page_size + 1,
+             'offset': (page - 1) * page_size, **kind_params}).all()
+        has_more = len(rows) > page_size
+        results = [{'kind': row.kind, 'ref_id': row.ref_id, 'project_id': row.project_id,
+                    'title': row.title, 'snippet': highlight(row.snippet)} for row in rows[:page_size]]
+    
+    return render_template('search.html', query=query, results=results, page=page, has_more=has_more)
+
 # Employees Routes (HR)
 @app.route('/employees')
 def employees():
@@ -458,8 +2356,57 @@ def employees():
         flash('ليس لديك صلاحية لعرض الموظفين', 'error')
         return redirect(url_for('dashboard'))
     
-    employees = User.query.all()
-    return render_template('employees.html', employees=employees)
+    versions, last_modified = read_stamps('users', 'workload')
+    etag = page_etag(*versions)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    employees = User.query.options(selectinload(User.workload)).all()
+    return tag_page(render_template('employees.html', employees=employees), etag, last_modified)
+
+@app.route('/employees/capacity')
+def employee_capacity():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    if session.get('role') not in ['hr', 'projects', 'master']:
+        flash('ليس لديك صلاحية لعرض عبء العمل', 'error')
+        return redirect(url_for('dashboard'))
+    
+    weeks = [week_start(datetime.utcnow().date()) + timedelta(weeks=i) for i in range(app.config['WORKLOAD_WEEKS'])]
+    sorts = {
+        'not_started': db.func.coalesce(EmployeeWorkload.not_started, 0),
+        'in_progress': db.func.coalesce(EmployeeWorkload.in_progress, 0),
+        'done': db.func.coalesce(EmployeeWorkload.done, 0),
+        'week': db.func.coalesce(EmployeeWeeklyEffort.effort_days, 0),
+        'name': User.full_name,
+    }
+    sort = request.args.get('sort') if request.args.get('sort') in sorts else 'in_progress'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = app.config['PAGE_SIZE']
+    
+    # One row per active employee; the counters and this week's effort are primary-key lookups
+    rows = (db.session.query(User, EmployeeWorkload)
+            .outerjoin(EmployeeWorkload, EmployeeWorkload.user_id == User.id)
+            .outerjoin(EmployeeWeeklyEffort, and_(EmployeeWeeklyEffort.user_id == User.id, EmployeeWeeklyEffort.week_start == weeks[0]))
+            .filter(User.is_active.is_(True))
+            .order_by(sorts[sort].asc() if direction == 'asc' else sorts[sort].desc(), User.id)
+            .limit(page_size + 1).offset((page - 1) * page_size).all())
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    
+    effort = {}
+    if rows:
+        weekly = db.session.query(EmployeeWeeklyEffort).filter(
+            EmployeeWeeklyEffort.user_id.in_([user.id for user, _ in rows]),
+            EmployeeWeeklyEffort.week_start.between(weeks[0], weeks[-1]))
+        effort = {(row.user_id, row.week_start): row.effort_days for row in weekly}
+    
+    return render_template('employee_capacity.html', rows=rows, weeks=weeks, effort=effort, sort=sort,
+                           direction=direction, page=page, has_more=has_more,
+                           capacity=app.config['WORKLOAD_WEEKLY_CAPACITY'])
 
 @app.route('/employee/add', methods=['GET', 'POST'])
 def add_employee():
@@ -473,7 +2420,7 @@ def add_employee():
     if request.method == 'POST':
         employee = User(
             username=request.form.get('username'),
-            password=generate_password_hash(request.form.get('password')),
+            password=hash_password(request.form.get('password')),
             role=request.form.get('role'),
             department=request.form.get('department'),
             full_name=request.form.get('full_name'),
@@ -482,6 +2429,7 @@ def add_employee():
             is_active=True
         )
         db.session.add(employee)
+        bump_stamp('users')
         db.session.commit()
         flash('تم إضافة الموظف بنجاح!', 'success')
         return redirect(url_for('employees'))
@@ -498,8 +2446,14 @@ def suppliers():
         flash('ليس لديك صلاحية لعرض الموردين', 'error')
         return redirect(url_for('dashboard'))
     
+    versions, last_modified = read_stamps('suppliers')
+    etag = page_etag(*versions)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
     suppliers = Supplier.query.all()
-    return render_template('suppliers.html', suppliers=suppliers)
+    return tag_page(render_template('suppliers.html', suppliers=suppliers), etag, last_modified)
 
 @app.route('/supplier/add', methods=['GET', 'POST'])
 def add_supplier():
@@ -520,13 +2474,257 @@ def add_supplier():
             is_active=True
         )
         db.session.add(supplier)
+        bump_stamp('suppliers')
         db.session.commit()
         flash('تم إضافة المورد بنجاح!', 'success')
         return redirect(url_for('suppliers'))
     
     return render_template('add_supplier.html')
 
-if __name__ == '__main__':
+# Bulk import
+ROLES = ['master', 'sales', 'management', 'projects', 'operations', 'procurement', 'finance', 'hr']
+
+class ImportRowError(ValueError):
+    pass
+
+def import_value(row, name, required=False):
+    value = row.get(name)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ImportRowError(f'الحقل {name} مطلوب')
+        return None
+    return value
+
+def import_date(row, name):
+    value = import_value(row, name)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        raise ImportRowError(f'تاريخ غير صحيح في {name}: {value}')
+
+def import_number(row, name, kind=float):
+    value = import_value(row, name)
+    try:
+        return kind(value) if value else None
+    except ValueError:
+        raise ImportRowError(f'رقم غير صحيح في {name}: {value}')
+
+def import_project(row):
+    return dict(project_code=import_value(row, 'project_code', True), name=import_value(row, 'name', True),
+                client_name=import_value(row, 'client_name'), description=import_value(row, 'description'),
+                estimated_cost=import_number(row, 'estimated_cost') or 0.0,
+                start_date=import_date(row, 'start_date'), end_date=import_date(row, 'end_date'),
+                status='pending_approval')
+
+def import_task(row):
+    project_id = import_number(row, 'project_id', int)
+    if project_id is None:
+        raise ImportRowError('الحقل project_id مطلوب')
+    return dict(project_id=project_id,
+                name=import_value(row, 'name', True), description=import_value(row, 'description'),
+                assigned_to=import_number(row, 'assigned_to', int),
+                start_date=import_date(row, 'start_date'), end_date=import_date(row, 'end_date'),
+                status='not_started', progress_percent=0)
+
+def import_employee(row):
+    role = import_value(row, 'role', True)
+    if role not in ROLES:
+        raise ImportRowError(f'دور غير معروف: {role}')
+    return dict(username=import_value(row, 'username', True), password=import_value(row, 'password', True),
+                role=role, department=import_value(row, 'department'), full_name=import_value(row, 'full_name'),
+                email=import_value(row, 'email'), phone=import_value(row, 'phone'), is_active=True)
+
+def import_supplier(row):
+    return dict(name=import_value(row, 'name', True), contact_person=import_value(row, 'contact_person'),
+                email=import_value(row, 'email'), phone=import_value(row, 'phone'),
+                address=import_value(row, 'address'), is_active=True)
+
+# kind -> (model, row validator, unique column, roles allowed to upload)
+IMPORTS = {
+    'projects': (Project, import_project, 'project_code', ['sales', 'master']),
+    'tasks': (Task, import_task, None, ['projects', 'master']),
+    'employees': (User, import_employee, 'username', ['hr', 'master']),
+    'suppliers': (Supplier, import_supplier, None, ['procurement', 'master']),
+}
+
+def read_import_rows(stream, filename):
+    """Yield dict rows from a binary CSV or JSON (list of objects) stream."""
+    if filename.lower().endswith('.json'):
+        data = json.load(stream)
+        if not isinstance(data, list):
+            raise ValueError('JSON must be a list of objects')
+        yield from ({} if not isinstance(item, dict) else item for item in data)
+    else:
+        yield from csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+def insert_import_chunk(kind, rows, imported_by=None):
+    """Insert validated rows plus their counter side effects and commit them as one transaction."""
+    model = IMPORTS[kind][0]
+    if kind in ('projects', 'tasks'):
+        # The new ids, in row order, for the change feed and the project timelines
+        ids = db.session.scalars(db.insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+    else:
+        db.session.execute(db.insert(model), rows)
+    if kind == 'projects':
+        increment_row(ProjectStatusCount, {'status': 'pending_approval'}, count=len(rows))
+        record_changes('project', ids)
+        db.session.execute(db.insert(ProjectActivity), [
+            {'project_id': project_id, 'user_id': row['created_by'], 'action': 'created',
+             'ref_id': project_id, 'new_value': row['status']}
+            for project_id, row in zip(ids, rows)])
+    elif kind == 'employees':
+        bump_stamp('users')
+    elif kind == 'suppliers':
+        bump_stamp('suppliers')
+    elif kind == 'tasks':
+        weights = {}
+        for row in rows:
+            weights[row['project_id']] = weights.get(row['project_id'], 0) + task_weight(Task(**row))
+        increment_rows(ProjectProgress, 'project_id', 'task_weight', weights)
+        apply_workload(workload_of(Task(**row) for row in rows))
+        Project.query.filter(Project.id.in_(weights)).update(
+            {Project.progress_percent: rollup_percent(), Project.version: Project.version + 1,
+             Project.updated_at: datetime.utcnow()}, synchronize_session=False)
+        schedule_new_tasks(Task.query.outerjoin(TaskSchedule, TaskSchedule.task_id == Task.id)
+                           .filter(Task.project_id.in_(weights), TaskSchedule.task_id.is_(None)))
+        record_changes('project', list(weights))
+        db.session.execute(db.insert(ProjectActivity), [
+            {'project_id': row['project_id'], 'user_id': imported_by, 'action': 'task_added',
+             'ref_id': task_id, 'new_value': (row.get('name') or '')[:50]}
+            for task_id, row in zip(ids, rows)])
+    db.session.commit()
+
+def run_import(kind, rows, created_by=None):
+    """Validate and insert ``rows`` in chunked transactions; returns (inserted, [(row number, error)])."""
+    model, validate, unique, _ = IMPORTS[kind]
+    inserted, errors, seen = 0, [], set()
+    
+    def flush(chunk):
+        nonlocal inserted
+        if unique:
+            column = getattr(model, unique)
+            taken = {value for value, in db.session.query(column).filter(column.in_([row[unique] for _, row in chunk]))}
+            for number, row in chunk:
+                if row[unique] in taken:
+                    errors.append((number, f'القيمة {row[unique]} موجودة مسبقاً'))
+            chunk = [(number, row) for number, row in chunk if row[unique] not in taken]
+        if kind == 'tasks':
+            project_ids = {row['project_id'] for _, row in chunk}
+            known = {value for value, in db.session.query(Project.id).filter(Project.id.in_(project_ids))}
+            for number, row in chunk:
+                if row['project_id'] not in known:
+                    errors.append((number, f"المشروع {row['project_id']} غير موجود"))
+            chunk = [(number, row) for number, row in chunk if row['project_id'] in known]
+        if not chunk:
+            return
+        if kind == 'employees':
+            # Hashed once, before the first attempt, so the per-row retry below never hashes a hash
+            for (_, row), password_hash in zip(chunk, hash_passwords([row['password'] for _, row in chunk])):
+                row['password'] = password_hash
+        try:
+            insert_import_chunk(kind, [row for _, row in chunk], created_by)
+            inserted += len(chunk)
+        except SQLAlchemyError:
+            db.session.rollback()
+            # Retry one row per transaction so only the offending rows are reported
+            for number, row in chunk:
+                try:
+                    insert_import_chunk(kind, [row], created_by)
+                    inserted += 1
+                except SQLAlchemyError as exc:
+                    db.session.rollback()
+                    errors.append((number, str(getattr(exc, 'orig', exc))))
+    
+    chunk, rows = [], iter(rows)
+    for number in itertools.count(1):
+        try:
+            raw = next(rows, None)
+        except (ValueError, csv.Error):
+            if number == 1:
+                raise
+            # Earlier chunks are already committed, so report where reading stopped instead of failing the import
+            errors.append((number, f'تعذر قراءة بقية الملف بعد السطر {number - 1}، ولم تُستورد الأسطر التالية'))
+            break
+        if raw is None:
+            break
+        try:
+            row = validate(raw)
+        except ImportRowError as exc:
+            errors.append((number, str(exc)))
+            continue
+        if unique:
+            if row[unique] in seen:
+                errors.append((number, f'القيمة {row[unique]} مكررة في الملف'))
+                continue
+            seen.add(row[unique])
+        if kind == 'projects':
+            row['created_by'] = created_by
+        chunk.append((number, row))
+        if len(chunk) >= app.config['IMPORT_CHUNK_SIZE']:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+    return inserted, sorted(errors)
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(list(IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--created-by', help='Username recorded as creator of imported projects')
+def import_data_command(kind, path, created_by):
+    """Bulk import projects, tasks, employees or suppliers from a CSV or JSON file."""
+    user = User.query.filter_by(username=created_by).first() if created_by else None
+    if created_by and user is None:
+        raise click.BadParameter(f'unknown user {created_by}', param_hint='--created-by')
+    with open(path, 'rb') as stream:
+        inserted, errors = run_import(kind, read_import_rows(stream, path), user.id if user else None)
+    for number, error in errors:
+        print(f"❌ row {number}: {error}")
+    print(f"✅ Imported {inserted} {kind} ({len(errors)} row(s) rejected)")
+
+@app.route('/import', methods=['GET', 'POST'])
+def bulk_import():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    kinds = [kind for kind, spec in IMPORTS.items() if session.get('role') in spec[3]]
+    if not kinds:
+        flash('ليس لديك صلاحية لاستيراد البيانات', 'error')
+        return redirect(url_for('dashboard'))
+    
+    result = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in kinds or not upload or not upload.filename:
+            flash('يرجى اختيار نوع البيانات والملف', 'error')
+        else:
+            try:
+                inserted, errors = run_import(kind, read_import_rows(upload.stream, upload.filename), session.get('user_id'))
+                result = {'kind': kind, 'inserted': inserted, 'errors': errors}
+            except (ValueError, UnicodeDecodeError, csv.Error):
+                flash('تعذر قراءة الملف، يرجى التأكد من أنه CSV أو JSON صحيح', 'error')
+    
+    return render_template('import.html', kinds=kinds, result=result)
+
+# Application entry point
+def create_app():
+    """Bootstrap the schema and warm per-process caches once, then return the app.
+    
+    gunicorn calls this as ``app:create_app()`` with preload_app (see gunicorn.conf.py), so it
+    runs once in the master and every worker forks ready to serve instead of repeating it.
+    """
     init_db()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    hash_prefix(app.config['PASSWORD_HASH_METHOD'])
+    asset_version()
+    with app.app_context():
+        # Workers must open their own connections, never share the master's
+        db.engine.dispose()
+    return app
+
+if __name__ == '__main__':
+    create_app()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,121 @@
+"""Compare mixed read/write throughput with default and tuned SQLite settings.
+
+Usage:
+    python benchmarks/concurrency.py [--workers 4] [--seconds 10] [--write-ratio 0.2]
+
+Each worker is a separate process (like a gunicorn sync worker) driving the
+app through the Flask test client against the same database file. Reads hit
+dashboard and project_details; writes add comments and update progress.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROFILES = {
+    # Roughly what SQLite and pysqlite do when left alone
+    'default': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_BUSY_TIMEOUT_MS': '5000',
+        'SQLITE_MMAP_SIZE': '0',
+        'SQLITE_CACHE_SIZE_KB': '2000',
+    },
+    # The app's own defaults
+    'tuned': {},
+}
+
+N_PROJECTS = 200
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    return parser.parse_args()
+
+
+def seed(env):
+    os.environ.update(env)
+    import app as m
+    m.init_db()
+    with m.app.app_context():
+        for i in range(N_PROJECTS):
+            m.db.session.add(m.Project(project_code=f'CONC-{i}', name=f'مشروع {i}', estimated_cost=1000,
+                                       created_by=2, status='in_progress'))
+        m.db.session.commit()
+        for i in range(N_PROJECTS * 10):
+            m.db.session.add(m.Comment(project_id=i % N_PROJECTS + 1, user_id=1, comment_text=f'تعليق {i}'))
+        m.db.session.commit()
+        m.rebuild_status_counts()
+
+
+def worker(env, seconds, write_ratio, seed_value, results):
+    os.environ.update(env)
+    import app as m
+    rng = random.Random(seed_value)
+    client = m.app.test_client()
+    client.post('/login', data={'username': 'master', 'password': 'admin123'})
+    reads = writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        project_id = rng.randint(1, N_PROJECTS)
+        if rng.random() < write_ratio:
+            if rng.random() < 0.5:
+                response = client.post(f'/project/{project_id}/comment/add', data={'comment_text': 'bench'})
+            else:
+                response = client.post(f'/project/{project_id}/update_progress', data={'progress': str(rng.randint(0, 100))})
+            writes += 1
+        else:
+            response = client.get(rng.choice(['/dashboard', f'/project/{project_id}']))
+            reads += 1
+        if response.status_code >= 500:
+            errors += 1
+    results.put((reads, writes, errors))
+
+
+def run_profile(name, overrides, args):
+    db_dir = tempfile.mkdtemp(prefix='bench-concurrency-')
+    env = dict(overrides, DATABASE_URL=f"sqlite:///{os.path.join(db_dir, 'projects.db')}",
+               FRAGMENT_CACHE_SIZE='0')
+    ctx = multiprocessing.get_context('spawn')
+    seeder = ctx.Process(target=seed, args=(env,))
+    seeder.start()
+    seeder.join()
+
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(env, args.seconds, args.write_ratio, i, results))
+             for i in range(args.workers)]
+    for proc in procs:
+        proc.start()
+    totals = [0, 0, 0]
+    for _ in procs:
+        for i, value in enumerate(results.get()):
+            totals[i] += value
+    for proc in procs:
+        proc.join()
+    shutil.rmtree(db_dir, ignore_errors=True)
+    reads, writes, errors = totals
+    ops = (reads + writes) / args.seconds
+    print(f'{name:<10}{ops:>10.1f}{reads / args.seconds:>10.1f}{writes / args.seconds:>10.1f}{errors:>8}')
+    return ops
+
+
+def main():
+    args = parse_args()
+    print(f'{args.workers} workers, {args.seconds:.0f}s per profile, {args.write_ratio:.0%} writes\n')
+    print(f"{'profile':<10}{'ops/s':>10}{'reads/s':>10}{'writes/s':>10}{'errors':>8}")
+    throughput = {name: run_profile(name, overrides, args) for name, overrides in PROFILES.items()}
+    print(f"\nTuned vs default: {throughput['tuned'] / max(throughput['default'], 1e-9):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
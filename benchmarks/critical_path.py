@@ -0,0 +1,157 @@
+"""Time critical-path scheduling on large task graphs.
+
+Usage:
+    python benchmarks/critical_path.py [--tasks 20000] [--fan-in 2] [--updates 200]
+
+Builds one project with ``--tasks`` tasks where each task depends on up to
+``--fan-in`` earlier tasks, then reports:
+
+    engine      CriticalPath.update() over the whole graph vs. after a single
+                task's duration changes (the incremental walk), and checks the
+                incremental result against a from-scratch computation
+    routes      the same graph in a temporary SQLite database: completing a
+                task, adding and removing a dependency, and a cold render of
+                the project page, through the Flask test client, then checks
+                the stored schedule against rebuild_schedules()
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=20_000)
+    parser.add_argument('--fan-in', type=int, default=2)
+    parser.add_argument('--window', type=int, default=200, help='a task depends on tasks at most this many ids back')
+    parser.add_argument('--updates', type=int, default=200)
+    return parser.parse_args()
+
+
+def random_graph(args, rng):
+    """(task number, start offset in days, duration in days) tuples and (task, depends on) edges."""
+    tasks = [(i, rng.randint(0, 30), rng.randint(1, 10)) for i in range(args.tasks)]
+    edges = set()
+    for i in range(1, args.tasks):
+        for _ in range(rng.randint(0, args.fan_in)):
+            edges.add((i, rng.randint(max(0, i - args.window), i - 1)))
+    return tasks, sorted(edges)
+
+
+def build(m, tasks, edges):
+    graph = m.CriticalPath()
+    for i, floor, duration in tasks:
+        graph.set_task(i, duration, floor)
+    for task, depends_on in edges:
+        graph.add_edge(task, depends_on)
+    return graph
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def bench_engine(m, args, rng, tasks, edges):
+    graph = build(m, tasks, edges)
+    began = time.perf_counter()
+    graph.update(graph.duration, graph.duration)
+    full_ms = (time.perf_counter() - began) * 1000
+
+    timings, moved = [], []
+    for _ in range(args.updates):
+        task = rng.randrange(args.tasks)
+        graph.set_task(task, rng.choice([0, rng.randint(1, 10)]), graph.floor[task])
+        began = time.perf_counter()
+        moved.append(len(graph.update([task], [task])))
+        timings.append((time.perf_counter() - began) * 1000)
+
+    check = build(m, [(i, graph.floor[i], graph.duration[i]) for i in graph.duration], edges)
+    check.update(check.duration, check.duration)
+    assert check.earliest == graph.earliest and check.tail == graph.tail, 'incremental schedule drifted from a full recompute'
+
+    finish = graph.finish()
+    critical = sum(1 for i in graph.duration if graph.duration[i] and graph.slack(i, finish) == 0)
+    print(f'engine: {args.tasks:,} tasks, {len(edges):,} edges, finish day {finish}, {critical:,} critical tasks')
+    print(f'  full schedule          {full_ms:>9.2f} ms')
+    print(f'  one task changed       {statistics.mean(timings):>9.2f} ms mean, {percentile(timings, 0.95):.2f} ms p95, '
+          f'{statistics.mean(moved):.0f} tasks moved on average')
+
+
+def bench_routes(m, args, rng, tasks, edges):
+    anchor = date(2026, 1, 1)
+    with m.app.app_context():
+        project = m.Project(project_code='CPM-BENCH', name='critical path benchmark', estimated_cost=0, created_by=1,
+                            status='in_progress', start_date=anchor)
+        m.db.session.add(project)
+        m.db.session.flush()
+        ids = {}
+        rows = [dict(project_id=project.id, name=f'مهمة {i}', status='not_started',
+                     start_date=anchor + timedelta(days=floor), end_date=anchor + timedelta(days=floor + duration - 1))
+                for i, floor, duration in tasks]
+        m.db.session.execute(m.db.insert(m.Task), rows)
+        for task_id, name in m.db.session.query(m.Task.id, m.Task.name).filter_by(project_id=project.id):
+            ids[int(name.split()[-1])] = task_id
+        m.db.session.execute(m.db.insert(m.TaskDependency), [
+            dict(project_id=project.id, task_id=ids[task], depends_on_id=ids[depends_on]) for task, depends_on in edges])
+        m.db.session.commit()
+        began = time.perf_counter()
+        m.rebuild_schedules()
+        print(f'\nroutes: rebuild_schedules() {(time.perf_counter() - began) * 1000:.0f} ms')
+        project_id = project.id
+
+    client = m.app.test_client()
+    client.post('/login', data={'username': 'master', 'password': 'admin123'})
+
+    def timed(method, url, **kwargs):
+        began = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = (time.perf_counter() - began) * 1000
+        assert response.status_code in (200, 302), (url, response.status_code)
+        return elapsed
+
+    picks = [ids[rng.randrange(args.tasks)] for _ in range(min(args.updates, 50))]
+    done = [timed('GET', f'/task/{task_id}/status/done') for task_id in picks]
+    late = [ids[i] for i in range(args.tasks - 50, args.tasks)]
+    added = [timed('POST', f'/project/{project_id}/dependency/add', data={'task_id': task_id, 'depends_on_id': ids[0]})
+             for task_id in late]
+    removed = [timed('GET', f'/task/{task_id}/dependency/{ids[0]}/remove') for task_id in late]
+    render = timed('GET', f'/project/{project_id}')
+    with m.app.app_context():
+        stored = m.load_critical_path(project_id)
+        m.rebuild_schedules()
+        fresh = m.load_critical_path(project_id)
+        assert stored.earliest == fresh.earliest and stored.tail == fresh.tail, 'stored schedule drifted from a rebuild'
+    for name, values in (('complete a task', done), ('add a dependency', added), ('remove a dependency', removed)):
+        print(f'  {name:<22} {statistics.mean(values):>9.2f} ms mean, {percentile(values, 0.95):.2f} ms p95')
+    print(f'  project page (cold)    {render:>9.2f} ms')
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix='bench-cpm-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'projects.db')}"
+    os.environ['TEMPLATE_CACHE_DIR'] = os.path.join(work_dir, 'jinja_cache')
+    import app as m
+    m.init_db()
+
+    try:
+        rng = random.Random(42)
+        tasks, edges = random_graph(args, rng)
+        bench_engine(m, args, rng, tasks, edges)
+        bench_routes(m, args, rng, tasks, edges)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""Drive every route under concurrent clients and compare against a stored baseline.
+
+Usage:
+    python benchmarks/load_test.py [--scale 1k|100k|1m] [--seconds 30] [--clients 16]
+                                   [--workers 2] [--threads 4] [--reuse] [--save-baseline]
+                                   [--tolerance 0.3] [--latency-tolerance 1.0]
+
+Seeds a SQLite dataset with the requested number of projects (tasks,
+comments, purchases and invoices in the proportions used by
+query_plans.py), starts gunicorn on it and runs ``--clients`` threads, one
+per seeded role in turn, each looping over that role's routes. Latency is
+measured by the clients; queries per request come from the app's own
+/metrics histograms, summed across workers.
+
+The run fails when total requests/sec drops, an endpoint's p95 latency grows,
+or an endpoint issues more queries per request than the stored baseline in
+benchmarks/baselines/load_test.json. Endpoints with too few samples for a
+stable mean (the write routes) are held to the per-request maximum instead,
+read from the histogram buckets. The fragment cache is disabled and the
+sampled ids are pinned to the seeded database, so every run issues the same
+requests. Baselines are machine specific: refresh them with --save-baseline
+on the machine that runs the check.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from query_plans import PASSWORDS, TABLE_SHARES, route_plan, sample_ids, seed  # noqa: E402
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baselines', 'load_test.json')
+
+# Ignore p95 growth below this many milliseconds; it is scheduler noise
+P95_FLOOR_MS = 25.0
+# Endpoints with fewer samples than this have no meaningful p95 or mean query count
+MIN_SAMPLES = 20
+# Extra queries per request tolerated before flagging an N+1
+QUERY_SLACK = 0.5
+
+METRIC_LINE = re.compile(r'^app_sql_queries_per_request_(sum|count)\{endpoint="([^"]+)"\} (\S+)$')
+BUCKET_LINE = re.compile(r'^app_sql_queries_per_request_bucket\{endpoint="([^"]+)",le="([^"]+)"\} (\S+)$')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='1k')
+    parser.add_argument('--db', help='database file (default /tmp/bench_load_<scale>.db)')
+    parser.add_argument('--reuse', action='store_true', help='keep an already seeded database')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed relative drop in total req/s')
+    parser.add_argument('--latency-tolerance', type=float, default=1.0,
+                        help='allowed relative growth in an endpoint p95')
+    parser.add_argument('--save-baseline', action='store_true')
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def opener():
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                       NoRedirect())
+
+
+def send(client, base, method, url, kwargs):
+    headers, body = {}, None
+    if 'json' in kwargs:
+        body, headers['Content-Type'] = json.dumps(kwargs['json']).encode(), 'application/json'
+    elif 'data' in kwargs:
+        body = urllib.parse.urlencode(kwargs['data']).encode()
+    elif method == 'POST':
+        body = b''
+    req = urllib.request.Request(base + urllib.parse.quote(url, safe='/?=&'), data=body,
+                                 headers=headers, method=method)
+    try:
+        with client.open(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        return exc.code
+
+
+def prepare_database(path, projects, reuse):
+    """Seed ``path`` unless reused and return the ids the route plan targets.
+    
+    The ids are sampled once, right after seeding, and kept next to the database: sampling a
+    reused database again would pick different rows once earlier runs have added tasks.
+    """
+    ids_path = path + '.ids.json'
+    if reuse and os.path.exists(path) and os.path.getsize(path) > 0 and os.path.exists(ids_path):
+        with open(ids_path) as handle:
+            return json.load(handle)
+    for stale in (path, ids_path):
+        if os.path.exists(stale):
+            os.remove(stale)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    import app as m
+    m.init_db()
+    with m.app.app_context():
+        engine = m.db.engine
+    began = time.perf_counter()
+    counts = seed(m, engine, int(projects / TABLE_SHARES['project']))
+    with m.app.app_context():
+        m.recompute_progress()
+        m.rebuild_ledger()
+    print(f'Seeded {sum(counts.values()):,} rows in {time.perf_counter() - began:.1f}s: {counts}')
+    ids = sample_ids(path)
+    with open(ids_path, 'w') as handle:
+        json.dump(ids, handle)
+    return ids
+
+
+def scrape_queries(base):
+    """Per-endpoint [sum, count, {bucket bound: cumulative count}] of the sql_queries_per_request histogram."""
+    totals = defaultdict(lambda: [0.0, 0.0, {}])
+    with urllib.request.urlopen(f'{base}/metrics', timeout=30) as response:
+        for line in response.read().decode().splitlines():
+            match = METRIC_LINE.match(line)
+            if match:
+                totals[match.group(2)][0 if match.group(1) == 'sum' else 1] = float(match.group(3))
+            match = BUCKET_LINE.match(line)
+            if match:
+                totals[match.group(1)][2][float(match.group(2))] = float(match.group(3))
+    return totals
+
+
+def max_queries(before, after):
+    """Upper bound of the most queries one request issued between two scrapes; None when above every bucket."""
+    count = after[1] - before[1]
+    for bound in sorted(after[2]):
+        if after[2][bound] - before[2].get(bound, 0.0) >= count:
+            return bound if bound != float('inf') else None
+    return None
+
+
+def run_load(base, url_map, plan, args):
+    roles = list(PASSWORDS)
+    stop, measuring = threading.Event(), threading.Event()
+    lock = threading.Lock()
+    latencies, errors = defaultdict(list), defaultdict(int)
+
+    def record(endpoint, status, elapsed):
+        if not measuring.is_set():
+            return
+        with lock:
+            latencies[endpoint].append(elapsed)
+            if status >= 500 and not (endpoint == 'login' and status == 503):
+                errors[endpoint] += 1
+
+    def login(client, role):
+        while not stop.is_set():
+            began = time.perf_counter()
+            status = send(client, base, 'POST', '/login',
+                          {'data': {'username': role, 'password': PASSWORDS[role]}})
+            record('login', status, time.perf_counter() - began)
+            if status != 503:
+                return
+            time.sleep(0.05)
+
+    def client_loop(index):
+        role = roles[index % len(roles)]
+        routes = [entry[1:] for entry in plan if entry[0] == role]
+        rng = random.Random(index)
+        client = opener()
+        login(client, role)
+        while not stop.is_set():
+            rng.shuffle(routes)
+            # Logging out ends the session, so it always closes the round
+            routes.sort(key=lambda route: route[1] == '/logout')
+            for method, url, kwargs in routes:
+                if stop.is_set():
+                    return
+                endpoint = url_map.match(url.split('?')[0], method=method)[0]
+                began = time.perf_counter()
+                status = send(client, base, method, url, kwargs)
+                record(endpoint, status, time.perf_counter() - began)
+                if endpoint == 'logout':
+                    login(client, role)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    before = scrape_queries(base)
+    measuring.set()
+    time.sleep(args.seconds)
+    measuring.clear()
+    after = scrape_queries(base)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for endpoint, values in sorted(latencies.items()):
+        count = after[endpoint][1] - before[endpoint][1]
+        queries = (after[endpoint][0] - before[endpoint][0]) / count if count else 0.0
+        results[endpoint] = {
+            'requests': len(values),
+            'rps': len(values) / args.seconds,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'queries': queries,
+            'max_queries': max_queries(before[endpoint], after[endpoint]) if count else 0.0,
+            'errors': errors[endpoint],
+        }
+    return results
+
+
+def compare(results, total_rps, baseline, tolerance, latency_tolerance):
+    failures = []
+    if total_rps < baseline['rps'] * (1 - tolerance):
+        failures.append(f"total req/s {total_rps:.1f} < baseline {baseline['rps']:.1f}")
+    for endpoint, row in results.items():
+        if row['errors']:
+            failures.append(f"{endpoint}: {row['errors']} server errors")
+        old = baseline['endpoints'].get(endpoint)
+        if not old:
+            continue
+        grown = row['p95_ms'] > old['p95_ms'] * (1 + latency_tolerance) and row['p95_ms'] - old['p95_ms'] > P95_FLOOR_MS
+        if grown and row['requests'] >= MIN_SAMPLES and old['requests'] >= MIN_SAMPLES:
+            failures.append(f"{endpoint}: p95 {row['p95_ms']:.1f} ms > baseline {old['p95_ms']:.1f} ms")
+        if row['requests'] >= MIN_SAMPLES and old['requests'] >= MIN_SAMPLES:
+            if row['queries'] > old['queries'] + QUERY_SLACK:
+                failures.append(f"{endpoint}: {row['queries']:.1f} queries/req > baseline {old['queries']:.1f}")
+        elif 'max_queries' in old and old['max_queries'] is not None and \
+                (row['max_queries'] is None or row['max_queries'] > old['max_queries']):
+            # A few samples give no stable mean, but every request's count falls in a histogram bucket
+            most = 'over 200' if row['max_queries'] is None else f"{row['max_queries']:g}"
+            failures.append(f"{endpoint}: up to {most} queries/req > baseline at most {old['max_queries']:g}")
+    return failures
+
+
+def main():
+    args = parse_args()
+    db = args.db or os.path.join(tempfile.gettempdir(), f'bench_load_{args.scale}.db')
+    plan = route_plan(*prepare_database(db, SCALES[args.scale], args.reuse))
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{db}'
+    import app as m
+    url_map = m.app.url_map.bind('localhost')
+
+    metrics_dir = tempfile.mkdtemp(prefix='bench-load-metrics-')
+    # /events answers with one poll instead of holding a client for minutes; gunicorn.conf.py
+    # picks the worker class (and whether to monkey-patch) from the environment. A disabled
+    # fragment cache makes project pages cost the same queries whichever writes ran before them.
+    env = dict(os.environ, METRICS_DIR=metrics_dir, CHANGE_FEED_MAX_SECONDS='0', GUNICORN_WORKER_CLASS='gthread',
+               FRAGMENT_CACHE_SIZE='0')
+    env.pop('METRICS_TOKEN', None)
+    env.pop('FRAGMENT_CACHE_PATH', None)
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--log-level', 'warning'],
+        cwd=ROOT, env=env)
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(f'{base}/login', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        results = run_load(base, url_map, plan, args)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    total_rps = sum(row['rps'] for row in results.values())
+    print(f'\n{args.scale} projects, {args.clients} clients, {args.workers} workers x {args.threads} threads, '
+          f'{args.seconds:.0f}s\n')
+    print(f"{'endpoint':<26}{'reqs':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+    for endpoint, row in results.items():
+        print(f"{endpoint:<26}{row['requests']:>7}{row['rps']:>8.1f}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+              f"{row['p99_ms']:>9.1f}{row['queries']:>9.1f}{row['errors']:>8}")
+    print(f'\nTotal: {total_rps:.1f} req/s')
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as handle:
+            baselines = json.load(handle)
+
+    if args.save_baseline:
+        baselines[args.scale] = {'rps': round(total_rps, 1), 'endpoints': {
+            endpoint: {'requests': row['requests'], 'p95_ms': round(row['p95_ms'], 1),
+                       'queries': round(row['queries'], 1), 'max_queries': row['max_queries']}
+            for endpoint, row in results.items()}}
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as handle:
+            json.dump(baselines, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+        print(f'✅ Saved {args.scale} baseline to {os.path.relpath(BASELINE_PATH, ROOT)}')
+        return 0
+
+    if args.scale not in baselines:
+        print(f'⚠️  No {args.scale} baseline stored; run with --save-baseline to create one')
+        return 0
+    failures = compare(results, total_rps, baselines[args.scale], args.tolerance, args.latency_tolerance)
+    if failures:
+        print(f'\n❌ {len(failures)} regression(s) against the {args.scale} baseline:')
+        for failure in failures:
+            print(f'  {failure}')
+        return 1
+    print(f'✅ No regressions against the {args.scale} baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
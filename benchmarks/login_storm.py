@@ -0,0 +1,162 @@
+"""Measure login throughput and the latency of other routes during a login storm.
+
+Usage:
+    python benchmarks/login_storm.py [--seconds 10] [--login-clients 16] [--page-clients 4]
+                                     [--workers 2] [--threads 8] [--login-hash-workers 2]
+                                     [--login-queue-size 2]
+
+Starts gunicorn (gthread workers) on a scratch database, then runs
+``--login-clients`` threads posting logins as fast as they can while
+``--page-clients`` threads load the dashboard with an existing session.
+Compare a bounded run with an effectively unbounded one (for example
+--login-hash-workers 16 --login-queue-size 100) to see how bounding
+verification protects page latency.
+"""
+import argparse
+import http.cookiejar
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--login-clients', type=int, default=16)
+    parser.add_argument('--page-clients', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--login-hash-workers', type=int, default=2)
+    parser.add_argument('--login-queue-size', type=int, default=2)
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def opener():
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                       NoRedirect())
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def request(client, url, data=None):
+    try:
+        with client.open(url, data=urllib.parse.urlencode(data).encode() if data else None, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def main():
+    args = parse_args()
+    db_dir = tempfile.mkdtemp(prefix='bench-login-')
+    # gunicorn.conf.py picks the worker class (and whether to monkey-patch) from the environment
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(db_dir, 'projects.db')}",
+               LOGIN_HASH_WORKERS=str(args.login_hash_workers), LOGIN_QUEUE_SIZE=str(args.login_queue_size),
+               GUNICORN_WORKER_CLASS='gthread')
+
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--log-level', 'warning'],
+        cwd=ROOT, env=env)
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f'{base}/login', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        login = {'username': 'hr', 'password': 'hr123'}
+        page_client = opener()
+        assert request(page_client, f'{base}/login', login) == 302
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        logins, busy, page_latencies = [], [0], []
+
+        def storm():
+            client = opener()
+            while not stop.is_set():
+                began = time.perf_counter()
+                status = request(client, f'{base}/login', login)
+                with lock:
+                    if status == 302:
+                        logins.append(time.perf_counter() - began)
+                    elif status == 503:
+                        busy[0] += 1
+
+        def pages():
+            client = opener()
+            request(client, f'{base}/login', login)
+            while not stop.is_set():
+                began = time.perf_counter()
+                request(client, f'{base}/dashboard')
+                with lock:
+                    page_latencies.append(time.perf_counter() - began)
+
+        # Baseline page latency without the storm
+        pagers = [threading.Thread(target=pages) for _ in range(args.page_clients)]
+        for thread in pagers:
+            thread.start()
+        time.sleep(min(3, args.seconds / 2))
+        stop.set()
+        for thread in pagers:
+            thread.join()
+        baseline = list(page_latencies)
+
+        stop.clear()
+        page_latencies.clear()
+        threads = [threading.Thread(target=storm) for _ in range(args.login_clients)]
+        threads += [threading.Thread(target=pages) for _ in range(args.page_clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    print(f'{args.workers} gunicorn workers x {args.threads} threads, '
+          f'LOGIN_HASH_WORKERS={args.login_hash_workers}, LOGIN_QUEUE_SIZE={args.login_queue_size}')
+    print(f'logins/sec:            {len(logins) / args.seconds:.1f} ({busy[0]} rejected as busy)')
+    print(f'login p50 / p99:       {percentile(logins, 0.5) * 1000:.0f} / {percentile(logins, 0.99) * 1000:.0f} ms')
+    print(f'dashboard p99 idle:    {percentile(baseline, 0.99) * 1000:.1f} ms')
+    print(f'dashboard p99 storm:   {percentile(page_latencies, 0.99) * 1000:.1f} ms '
+          f'({len(page_latencies) / args.seconds:.1f} req/s)')
+
+
+if __name__ == '__main__':
+    main()
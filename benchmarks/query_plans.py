@@ -0,0 +1,264 @@
+"""Seed a large synthetic database, time every route's SQL and check query plans.
+
+Usage:
+    python benchmarks/query_plans.py [--rows 1000000] [--db /tmp/bench_projects.db] [--reuse]
+
+Exits non-zero when a route issues a query whose plan contains a full table
+scan that is not listed in ALLOWED_SCANS.
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Share of the total row budget given to each table
+TABLE_SHARES = {
+    'project': 0.05,
+    'task': 0.30,
+    'purchase_request': 0.15,
+    'invoice': 0.15,
+    'comment': 0.35,
+}
+
+# Routes that list a whole (small) table on purpose
+ALLOWED_SCANS = {
+    ('employees', 'user'),
+    ('suppliers', 'supplier'),
+    (None, 'project_status_count'),
+    # Portfolio totals are O(projects) by design
+    ('portfolio_report', 'project'),
+    ('portfolio_report', 'project_ledger'),
+}
+
+PASSWORDS = {
+    'master': 'admin123', 'sales': 'sales123', 'manager': 'manager123',
+    'projects': 'projects123', 'operations': 'operations123',
+    'procurement': 'procurement123', 'finance': 'finance123', 'hr': 'hr123',
+}
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?!.*(USING|VIRTUAL TABLE))')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', default='/tmp/bench_projects.db')
+    parser.add_argument('--reuse', action='store_true', help='keep an already seeded database')
+    return parser.parse_args()
+
+
+def chunked_insert(conn, table, rows, size=20_000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def seed(m, engine, total_rows):
+    rng = random.Random(42)
+    counts = {name: max(1, int(total_rows * share)) for name, share in TABLE_SHARES.items()}
+    n_users, n_suppliers = 200, 500
+    statuses = ['pending_approval', 'approved', 'in_progress', 'on_hold', 'completed', 'rejected', 'cancelled']
+    start = datetime(2020, 1, 1)
+
+    def stamp(i, n):
+        return start + timedelta(seconds=int(i * 150_000_000 / n))
+
+    with engine.begin() as conn:
+        chunked_insert(conn, m.User.__table__, (
+            dict(username=f'user{i}', password='x', role='operations', department='التشغيل',
+                 full_name=f'موظف {i}', is_active=True)
+            for i in range(n_users)))
+        chunked_insert(conn, m.Supplier.__table__, (
+            dict(name=f'مورد {i}', contact_person=f'شخص {i}', is_active=True, created_at=stamp(i, n_suppliers))
+            for i in range(n_suppliers)))
+        n = counts['project']
+        chunked_insert(conn, m.Project.__table__, (
+            dict(project_code=f'BENCH-{i}', name=f'مشروع {i}', client_name=f'عميل {i % 997}',
+                 estimated_cost=rng.uniform(1e3, 1e6), status=rng.choice(statuses),
+                 progress_percent=rng.randint(0, 100), created_by=rng.randint(1, 8),
+                 start_date=date(2020, 1, 1), created_at=stamp(i, n))
+            for i in range(n)))
+        n = counts['task']
+        chunked_insert(conn, m.Task.__table__, (
+            dict(project_id=rng.randint(1, counts['project']), name=f'مهمة {i}',
+                 assigned_to=rng.randint(1, n_users), status=rng.choice(['not_started', 'in_progress', 'done']),
+                 created_at=stamp(i, n))
+            for i in range(n)))
+        n = counts['purchase_request']
+        chunked_insert(conn, m.PurchaseRequest.__table__, (
+            dict(project_id=rng.randint(1, counts['project']), requested_by=rng.randint(1, 8),
+                 supplier_id=rng.randint(1, n_suppliers), description=f'طلب {i}',
+                 estimated_cost=rng.uniform(10, 1e4), status=rng.choice(['pending', 'approved', 'rejected']),
+                 created_at=stamp(i, n))
+            for i in range(n)))
+        n = counts['invoice']
+        chunked_insert(conn, m.Invoice.__table__, (
+            dict(project_id=rng.randint(1, counts['project']), invoice_type=rng.choice(['client', 'supplier']),
+                 amount=rng.uniform(10, 1e5), payment_status=rng.choice(['pending', 'paid']),
+                 created_by=7, created_at=stamp(i, n))
+            for i in range(n)))
+        n = counts['comment']
+        chunked_insert(conn, m.Comment.__table__, (
+            dict(project_id=rng.randint(1, counts['project']), user_id=rng.randint(1, n_users),
+                 comment_text=f'تعليق رقم {i}', created_at=stamp(i, n))
+            for i in range(n)))
+    with m.app.app_context():
+        m.rebuild_status_counts()
+        m.backfill_activity()
+        m.rebuild_schedules()
+        m.rebuild_workload()
+    return counts
+
+
+def sample_ids(path):
+    """Mid-table ids for route_plan; the two tasks share a project, which the project routes use too."""
+    with sqlite3.connect(path) as conn:
+        task_id, project_id = conn.execute(
+            'SELECT id, project_id FROM task WHERE id >= (SELECT max(id) FROM task) / 2 ORDER BY id LIMIT 1').fetchone()
+        depends_on_id = conn.execute('SELECT id FROM task WHERE project_id = ? AND id != ? LIMIT 1',
+                                     (project_id, task_id)).fetchone()
+        purchase_id, invoice_id = (conn.execute(f'SELECT max(id) FROM {table}').fetchone()[0] // 2
+                                   for table in ('purchase_request', 'invoice'))
+    return project_id, task_id, purchase_id, invoice_id, depends_on_id[0] if depends_on_id else task_id
+
+
+def route_plan(project_id, task_id, purchase_id, invoice_id, depends_on_id):
+    """(role, method, url, request kwargs) tuples covering every route in app.py."""
+    reads = ['/dashboard', f'/project/{project_id}', '/purchase/add', '/invoice/add',
+             '/project/add', '/employees', '/employees/capacity?sort=week', '/employee/add', '/suppliers', '/supplier/add',
+             '/reports/portfolio', '/import', '/search?q=تعليق رقم 12', '/events?after=0']
+    plan = [(role, 'GET', url, {}) for role in PASSWORDS for url in reads]
+    plan += [
+        ('master', 'GET', '/', {}),
+        ('master', 'POST', f'/project/{project_id}/update_progress', {'data': {'progress': '40'}}),
+        ('master', 'POST', f'/project/{project_id}/comment/add', {'data': {'comment_text': 'benchmark'}}),
+        ('master', 'POST', f'/project/{project_id}/task/add', {'data': {'name': 'benchmark', 'assigned_to': '1'}}),
+        ('master', 'GET', f'/task/{task_id}/status/in_progress', {}),
+        ('master', 'POST', f'/project/{project_id}/dependency/add', {'data': {'task_id': task_id, 'depends_on_id': depends_on_id}}),
+        ('master', 'GET', f'/task/{task_id}/dependency/{depends_on_id}/remove', {}),
+        ('master', 'GET', f'/project/{project_id}/approve', {}),
+        ('master', 'GET', f'/project/{project_id}/status/in_progress', {}),
+        ('master', 'GET', f'/project/{project_id + 1}/reject', {}),
+        ('master', 'GET', f'/purchase/{purchase_id}/approve', {}),
+        ('master', 'GET', f'/purchase/{purchase_id + 1}/reject', {}),
+        ('master', 'GET', f'/invoice/{invoice_id}/paid', {}),
+        ('master', 'POST', '/api/bulk/projects', {'json': {'ids': list(range(project_id, project_id + 50)), 'status': 'approved'}}),
+        ('master', 'POST', '/api/bulk/purchases', {'json': {'ids': list(range(purchase_id, purchase_id + 50)), 'status': 'approved'}}),
+        ('master', 'POST', '/api/bulk/invoices', {'json': {'ids': list(range(invoice_id, invoice_id + 50)), 'status': 'paid'}}),
+        ('master', 'GET', f'/export/tasks.csv?project_id={project_id}', {}),
+        ('master', 'GET', '/export/invoices.csv?status=paid&date_from=2021-01-01&date_to=2021-01-31', {}),
+        ('master', 'GET', '/export/suppliers.csv', {}),
+        ('master', 'GET', '/metrics', {}),
+        ('master', 'GET', '/logout', {}),
+    ]
+    return plan
+
+
+def main():
+    args = parse_args()
+    if not args.reuse and os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    # One poll per /events request instead of holding the stream open
+    os.environ['CHANGE_FEED_MAX_SECONDS'] = '0'
+
+    import app as m
+    from sqlalchemy import event
+
+    seeded = args.reuse and os.path.exists(args.db) and os.path.getsize(args.db) > 0
+    m.init_db()
+    with m.app.app_context():
+        engine = m.db.engine
+    if not seeded:
+        began = time.perf_counter()
+        counts = seed(m, engine, args.rows)
+        print(f'Seeded {sum(counts.values()):,} rows in {time.perf_counter() - began:.1f}s: {counts}')
+
+    captured = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0]
+        captured.append((statement, parameters, time.perf_counter() - conn.info.pop('query_start')))
+
+    ids = sample_ids(args.db)
+
+    clients = {}
+    for role, password in PASSWORDS.items():
+        clients[role] = m.app.test_client()
+        clients[role].post('/login', data={'username': role, 'password': password})
+
+    stats = defaultdict(lambda: {'requests': 0, 'queries': 0, 'sql': 0.0, 'wall': 0.0})
+    statements = defaultdict(set)
+    for role, method, url, kwargs in route_plan(*ids):
+        client = clients[role]
+        endpoint = m.app.url_map.bind('localhost').match(url.split('?')[0], method=method)[0]
+        del captured[:]
+        began = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        response.close()
+        wall = time.perf_counter() - began
+        if response.status_code >= 500:
+            print(f'❌ {method} {url} as {role} returned {response.status_code}')
+            return 1
+        row = stats[endpoint]
+        row['requests'] += 1
+        row['queries'] += len(captured)
+        row['sql'] += sum(elapsed for _, _, elapsed in captured)
+        row['wall'] += wall
+        for statement, parameters, _ in captured:
+            if statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+                statements[endpoint].add((statement, tuple(parameters or ())))
+
+    print(f"\n{'endpoint':<26}{'reqs':>6}{'queries/req':>13}{'sql ms/req':>12}{'wall ms/req':>13}")
+    for endpoint, row in sorted(stats.items()):
+        n = row['requests']
+        print(f"{endpoint:<26}{n:>6}{row['queries'] / n:>13.1f}{row['sql'] * 1000 / n:>12.2f}{row['wall'] * 1000 / n:>13.2f}")
+
+    failures = []
+    with engine.connect() as conn:
+        for endpoint, seen in sorted(statements.items()):
+            for statement, parameters in seen:
+                plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+                for detail in (row[-1] for row in plan):
+                    match = FULL_SCAN.match(detail)
+                    if not match:
+                        continue
+                    table = match.group(1)
+                    # Scanning a CTE or subquery walks its own (already bounded) result, not a table
+                    if table not in m.db.metadata.tables:
+                        continue
+                    if (endpoint, table) in ALLOWED_SCANS or (None, table) in ALLOWED_SCANS:
+                        continue
+                    failures.append((endpoint, detail, ' '.join(statement.split())))
+
+    if failures:
+        print(f'\n❌ {len(failures)} full table scan(s):')
+        for endpoint, detail, statement in failures:
+            print(f'  [{endpoint}] {detail}\n      {statement[:200]}')
+        return 1
+    print('\n✅ No unexpected full table scans')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
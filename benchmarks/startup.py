@@ -0,0 +1,117 @@
+"""Measure how long a new worker takes to serve its first requests.
+
+Usage:
+    python benchmarks/startup.py [--workers 4] [--rows 20000]
+
+Mimics what gunicorn does when it boots or recycles workers: a master
+process forks ``--workers`` children and each child times how long after
+the fork it has served GET /dashboard and GET /project/1 through the test
+client. Scenarios:
+
+    per-worker        each worker imports the app and runs create_app()
+                      itself, with an empty Jinja bytecode cache
+    per-worker+bcc    the same with the bytecode cache already filled
+    preload           the master runs create_app() once and workers fork
+                      from it (gunicorn.conf.py's preload_app)
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUESTS = ['/dashboard', '/project/1']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=20_000)
+    return parser.parse_args()
+
+
+def seed_database(env, rows):
+    os.environ.update(env)
+    import app as m
+    from query_plans import seed
+    m.init_db()
+    with m.app.app_context():
+        engine = m.db.engine
+    seed(m, engine, rows)
+
+
+def serve_first_requests(m):
+    client = m.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(user_id=1, username='master', role='master', department='الإدارة العامة')
+    for url in FIRST_REQUESTS:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+
+
+def worker(preloaded, forked_at, results):
+    import app as m
+    if not preloaded:
+        m.create_app()
+    serve_first_requests(m)
+    results.put(time.perf_counter() - forked_at)
+
+
+def master(preload, env, workers, results):
+    os.environ.update(env)
+    began = time.perf_counter()
+    if preload:
+        import app as m
+        m.create_app()
+    boot = time.perf_counter() - began
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    procs = []
+    for _ in range(workers):
+        procs.append(ctx.Process(target=worker, args=(preload, time.perf_counter(), queue)))
+        procs[-1].start()
+    timings = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    results.put((boot, timings))
+
+
+def run_scenario(preload, env, workers):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=master, args=(preload, env, workers, results))
+    proc.start()
+    boot, timings = results.get()
+    proc.join()
+    return boot, timings
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    cache_dir = os.path.join(work_dir, 'jinja_cache')
+    env = {'DATABASE_URL': f"sqlite:///{os.path.join(work_dir, 'projects.db')}", 'TEMPLATE_CACHE_DIR': cache_dir}
+    try:
+        seeder = multiprocessing.get_context('spawn').Process(target=seed_database, args=(env, args.rows))
+        seeder.start()
+        seeder.join()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+        print(f'{args.workers} workers, {args.rows:,} seeded rows\n')
+        print(f"{'scenario':<16}{'master ms':>11}{'worker mean ms':>16}{'worker max ms':>15}{'all ready ms':>14}")
+        for name, preload in (('per-worker', False), ('per-worker+bcc', False), ('preload', True)):
+            boot, timings = run_scenario(preload, env, args.workers)
+            print(f'{name:<16}{boot * 1000:>11.1f}{sum(timings) / len(timings) * 1000:>16.1f}'
+                  f'{max(timings) * 1000:>15.1f}{(boot + max(timings)) * 1000:>14.1f}')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""gunicorn settings for ``gunicorn 'app:create_app()'`` (see Procfile)."""
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = 1000
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Load the app (schema bootstrap, template compilation) once in the master; workers fork from it
+preload_app = True
+
+# /metrics sums every worker's snapshot from this directory; without it each scrape
+# would only see the worker that answered. Set before the app is imported.
+os.environ.setdefault('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+
+if worker_class == 'gevent':
+    # Preloading imports the app in the master, so patch first: locks and connection
+    # pools created at import must be cooperative in the forked gevent workers
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def on_starting(server):
+    # Snapshots left by a previous run would be summed into this run's scrapes
+    directory = os.environ['METRICS_DIR']
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(directory, name))